@@ -0,0 +1,113 @@
+import numpy as np
+
+# (row, column) of the eight free entries of a homography, h33 stays at 1
+ENTRIES = [(r, c) for r in range(3) for c in range(3)][:8]
+
+
+def transfer(Ha, Hb, points):
+    # map points of image a into image b through the reference frame
+    Binv = np.linalg.inv(Hb)
+    homogeneous = np.hstack([points, np.ones((len(points), 1))])
+    x = homogeneous @ Ha.T
+    y = x @ Binv.T
+    return y[:, :2] / y[:, 2:], homogeneous, x, y, Binv
+
+
+def transferJacobian(Ha, Hb, points):
+    # residual rows for the transfer a -> b and its derivatives by the free entries
+    # of Ha and Hb, each (n, 2, 8)
+    projected, p, x, y, Binv = transfer(Ha, Hb, points)
+    n = len(points)
+    dfdy = np.zeros((n, 2, 3))
+    dfdy[:, 0, 0] = dfdy[:, 1, 1] = 1 / y[:, 2]
+    dfdy[:, :, 2] = -projected / y[:, 2:]
+    Ja = np.zeros((n, 2, 8))
+    Jb = np.zeros((n, 2, 8))
+    for k, (r, c) in enumerate(ENTRIES):
+        # y = Hb^-1 Ha p, so dy/dHa[r, c] = Hb^-1[:, r] p_c and
+        # dy/dHb[r, c] = -Hb^-1[:, r] y_c
+        Ja[:, :, k] = dfdy @ Binv[:, r] * p[:, c : c + 1]
+        Jb[:, :, k] = -(dfdy @ Binv[:, r]) * y[:, c : c + 1]
+    return projected, Ja, Jb
+
+
+def adjustHomographies(transforms, observations, reference, iterations=20):
+    # transforms maps image index to its homography into the reference frame,
+    # observations holds (a, b, pointsA, pointsB) inlier correspondences per pair.
+    # Residuals are measured in the pixels of the images themselves, both ways, so
+    # shrinking the mosaic cannot lower the cost. The reference stays fixed to pin
+    # the gauge and every other image has eight parameters, a pair only couples the
+    # blocks of its two images so the normal equations are assembled edge by edge
+    # over the match graph and solved with Levenberg-Marquardt damping. The system
+    # is held and solved dense, 8(N - 1) square: under a millisecond per solve for
+    # 20 images, about 40 ms for 100 and most of a second for 300. Beyond a few
+    # hundred images it wants a sparse solver
+    images = sorted(i for i in transforms if i != reference)
+    if not images or not observations:
+        return transforms
+    slot = {image: k for k, image in enumerate(images)}
+
+    # work in coordinates of order one so every entry has a comparable scale
+    scale = max(
+        np.abs(points).max() for _, _, pa, pb in observations for points in (pa, pb)
+    )
+    N = np.diag([1 / scale, 1 / scale, 1.0])
+    H = {}
+    for i, T in transforms.items():
+        T = N @ T @ np.linalg.inv(N)
+        H[i] = T / T[2, 2]
+    edges = []
+    for a, b, pa, pb in observations:
+        edges.append((a, b, pa / scale, pb / scale))
+        edges.append((b, a, pb / scale, pa / scale))
+
+    def cost(H):
+        return sum(
+            np.sum((transfer(H[a], H[b], pa)[0] - pb) ** 2) for a, b, pa, pb in edges
+        )
+
+    current = cost(H)
+    damping = 1e-3
+    for _ in range(iterations):
+        size = 8 * len(images)
+        A = np.zeros((size, size))
+        g = np.zeros(size)
+        for a, b, pa, pb in edges:
+            projected, Ja, Jb = transferJacobian(H[a], H[b], pa)
+            residual = (projected - pb).reshape(-1)
+            blocks = [
+                (slot[i], J.reshape(-1, 8)) for i, J in ((a, Ja), (b, Jb)) if i in slot
+            ]
+            for k, Jk in blocks:
+                g[8 * k : 8 * k + 8] += Jk.T @ residual
+                for l, Jl in blocks:
+                    A[8 * k : 8 * k + 8, 8 * l : 8 * l + 8] += Jk.T @ Jl
+
+        diagonal = np.diag(A).copy() + 1e-12
+        while True:
+            try:
+                step = np.linalg.solve(A + damping * np.diag(diagonal), -g)
+            except np.linalg.LinAlgError:
+                step = None
+            if step is not None:
+                candidate = dict(H)
+                for image in images:
+                    k = slot[image]
+                    candidate[image] = H[image] + np.append(
+                        step[8 * k : 8 * k + 8], 0.0
+                    ).reshape(3, 3)
+                candidateCost = cost(candidate)
+                if candidateCost < current:
+                    converged = current - candidateCost < 1e-9 + 1e-6 * current
+                    H, current = candidate, candidateCost
+                    damping = max(damping / 10, 1e-9)
+                    break
+            damping *= 10
+            if damping > 1e8:
+                converged = True
+                break
+        if converged:
+            break
+
+    Ninv = np.linalg.inv(N)
+    return {i: Ninv @ T @ N for i, T in H.items()}
@@ -0,0 +1,239 @@
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from loading import RAW_EXTENSIONS
+from sinks import DirectorySink
+from works import ESTIMATORS, Stitching
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff', '.npy')
+
+
+def naturalKey(name):
+    # 2.jpg before 10.jpg, capture counters are rarely zero padded
+    return [
+        int(part) if part.isdigit() else part.lower() for part in re.split(r'(\d+)', name)
+    ]
+
+
+def findSessions(root, extensions=IMAGE_EXTENSIONS):
+    # every directory holding at least two captures is one session
+    sessions = {}
+    for directory, _, files in os.walk(root):
+        images = sorted(
+            (name for name in files if name.lower().endswith(extensions)), key=naturalKey
+        )
+        if len(images) >= 2:
+            name = os.path.relpath(directory, root)
+            sessions[name] = [os.path.join(directory, image) for image in images]
+    return sessions
+
+
+def readManifest(path):
+    # {"session name": ["capture 1", "capture 2", ...]}, paths relative to the manifest
+    with open(path, encoding='utf-8') as file:
+        manifest = json.load(file)
+    base = os.path.dirname(os.path.abspath(path))
+    return {
+        name: [os.path.join(base, image) for image in images]
+        for name, images in manifest.items()
+    }
+
+
+def stitchSession(
+    name,
+    imagePaths,
+    outputDir,
+    method,
+    threshold,
+    estimator,
+    options,
+    metrics=False,
+    memmap=False,
+):
+    startPerf = time.perf_counter()
+    try:
+        if memmap:
+            os.makedirs(os.path.join(outputDir, name), exist_ok=True)
+            options = dict(
+                options, canvasPath=os.path.join(outputDir, name, 'mosaic.npy')
+            )
+        # mosaics go to disk as soon as they are blended instead of piling up
+        s = Stitching(
+            [method, estimator, threshold, False, False, '', False],
+            imagePaths,
+            diagnostics=False,
+            sink=DirectorySink(os.path.join(outputDir, name)),
+            **options,
+        )
+        report = s.run()
+        if metrics:
+            report.toJson(os.path.join(outputDir, name, 'metrics.json'))
+        fail = s.fail
+        error = 'too few matches' if fail else ''
+    except Exception as e:
+        fail, error = True, '%s: %s' % (type(e).__name__, ' '.join(str(e).split()))
+    return name, fail, error, time.perf_counter() - startPerf
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Stitch every capture session under a directory or in a manifest.'
+    )
+    parser.add_argument('input', help='session directory tree or JSON manifest')
+    parser.add_argument('-o', '--output', default='results')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1)
+    parser.add_argument(
+        '-m',
+        '--method',
+        default='sift',
+        choices=['sift', 'orb', 'brisk', 'akaze', 'minutiae'],
+    )
+    parser.add_argument('-t', '--threshold', type=float, default=7.0)
+    parser.add_argument(
+        '-e', '--estimator', default='ransac', choices=sorted(ESTIMATORS)
+    )
+    parser.add_argument('--confidence', type=float, default=0.995)
+    parser.add_argument('--max-iters', type=int, default=2000)
+    parser.add_argument(
+        '--adaptive',
+        action='store_true',
+        help='tighten the threshold to the residual noise of every pair',
+    )
+    parser.add_argument('--cache', help='feature cache directory')
+    parser.add_argument('--pyramid-levels', type=int, default=0)
+    parser.add_argument(
+        '--unordered', action='store_true', help='captures are not in sweep order'
+    )
+    parser.add_argument(
+        '--metrics', action='store_true', help='write metrics.json for every session'
+    )
+    parser.add_argument(
+        '--grayscale', action='store_true', help='decode and stitch a single channel'
+    )
+    parser.add_argument(
+        '--overlap',
+        action='store_true',
+        help='match consecutive captures only where they are predicted to overlap',
+    )
+    parser.add_argument(
+        '--overlap-hint',
+        nargs=2,
+        type=float,
+        metavar=('DX', 'DY'),
+        help='content shift from one capture to the next, also masks detection',
+    )
+    parser.add_argument(
+        '--blending',
+        choices=['multiband', 'feather', 'average'],
+        help='default multiband, not with --tile-size',
+    )
+    parser.add_argument(
+        '--seams',
+        choices=['dp', 'graphcut', 'voronoi', 'none'],
+        help='default dp, not with --tile-size',
+    )
+    parser.add_argument(
+        '--tile-size',
+        type=int,
+        help='render mosaics in tiles of this many pixels, feathered by border distance',
+    )
+    parser.add_argument(
+        '--memmap',
+        action='store_true',
+        help='with --tile-size, render each mosaic into a memory mapped mosaic.npy',
+    )
+    parser.add_argument(
+        '--reduce', type=int, default=1, choices=[1, 2, 4, 8], help='decode at 1/N size'
+    )
+    parser.add_argument(
+        '--raw-shape',
+        nargs=2,
+        type=int,
+        metavar=('HEIGHT', 'WIDTH'),
+        help='also read headerless 8 bit sensor dumps (.raw, .bin) of this size',
+    )
+    parser.add_argument(
+        '--align',
+        default='features',
+        choices=['features', 'phase'],
+        help='phase: register consecutive captures by phase correlation first',
+    )
+    parser.add_argument(
+        '--phase-rotation',
+        action='store_true',
+        help='with --align phase, also correct small rotations between captures',
+    )
+    args = parser.parse_args(argv)
+    if args.tile_size and (args.blending or args.seams):
+        parser.error('tiled rendering has its own blending, drop --blending and --seams')
+    if args.memmap and not args.tile_size:
+        parser.error('--memmap needs --tile-size')
+
+    if os.path.isdir(args.input):
+        extensions = IMAGE_EXTENSIONS + (RAW_EXTENSIONS if args.raw_shape else ())
+        sessions = findSessions(args.input, extensions)
+    else:
+        sessions = readManifest(args.input)
+    options = dict(
+        cache=args.cache,
+        pyramidLevels=args.pyramid_levels,
+        ordered=not args.unordered,
+        grayscale=args.grayscale,
+        overlap=args.overlap,
+        overlapHint=args.overlap_hint,
+        confidence=args.confidence,
+        maxIters=args.max_iters,
+        adaptive=args.adaptive,
+        blending=args.blending or 'multiband',
+        seams=args.seams or 'dp',
+        tileSize=args.tile_size,
+        reduce=args.reduce,
+        rawShape=args.raw_shape,
+        align=args.align,
+        phaseRotation=args.phase_rotation,
+    )
+
+    failed = 0
+    startPerf = time.perf_counter()
+    # peak memory is the high-water mark of the whole worker, so a worker that stitched
+    # an earlier session would report that one too. Every session gets its own then
+    with ProcessPoolExecutor(
+        max_workers=args.jobs, max_tasks_per_child=1 if args.metrics else None
+    ) as pool:
+        futures = [
+            pool.submit(
+                stitchSession,
+                name,
+                paths,
+                args.output,
+                args.method,
+                args.threshold,
+                args.estimator,
+                options,
+                args.metrics,
+                args.memmap,
+            )
+            for name, paths in sessions.items()
+        ]
+        for done, future in enumerate(as_completed(futures), 1):
+            name, fail, error, elapsed = future.result()
+            failed += fail
+            print(
+                '[%d/%d] %s %s %.2fs %s'
+                % (done, len(futures), name, 'failed' if fail else 'ok', elapsed, error),
+                flush=True,
+            )
+    print(
+        '%d sessions, %d failed, %.2fs'
+        % (len(sessions), failed, time.perf_counter() - startPerf)
+    )
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,206 @@
+import argparse
+import json
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+from works import Stitching
+
+
+def ridgePattern(width, height, seed=0, wavelength=9.0):
+    # band-limited noise pushed through a Gabor bank, close enough to friction ridges
+    # to give every detector a realistic number of repetitive features
+    rng = np.random.default_rng(seed)
+    noise = rng.random((height, width)).astype(np.float32)
+    ridges = np.zeros_like(noise)
+    for theta in np.linspace(0, np.pi, 8, endpoint=False):
+        kernel = cv2.getGaborKernel(
+            (21, 21), 4.0, theta, wavelength, 0.6, ktype=cv2.CV_32F
+        )
+        ridges = np.maximum(ridges, cv2.filter2D(noise, -1, kernel))
+    ridges = cv2.normalize(ridges, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
+    return cv2.cvtColor(ridges, cv2.COLOR_GRAY2BGR)
+
+
+def sweep(size, count, overlap=0.5, seed=0):
+    # returns captures of a swipe across one ridge pattern and the ground-truth
+    # homographies mapping the pattern into each capture
+    rng = np.random.default_rng(seed)
+    step = size * (1 - overlap)
+    margin = size // 4
+    width = int(size + step * (count - 1)) + 2 * margin
+    height = size + 2 * margin
+    pattern = ridgePattern(width, height, seed)
+
+    images, truths = [], []
+    for k in range(count):
+        angle = rng.uniform(-3, 3)
+        scale = rng.uniform(0.97, 1.03)
+        center = (margin + k * step + size / 2, margin + size / 2)
+        rotation = np.vstack([cv2.getRotationMatrix2D(center, angle, scale), [0, 0, 1]])
+        shift = np.array(
+            [[1, 0, size / 2 - center[0]], [0, 1, size / 2 - center[1]], [0, 0, 1]]
+        )
+        H = shift @ rotation
+        H[2, :2] = rng.uniform(-2e-5, 2e-5, 2)
+        images.append(cv2.warpPerspective(pattern, H, (size, size)))
+        truths.append(H)
+    return images, truths
+
+
+def cornerError(estimated, truths, size):
+    # mean corner distance, in reference pixels, between estimated and true
+    # capture-to-reference transforms, both normalised to capture 0
+    corners = np.float32([[0, 0], [size, 0], [size, size], [0, size]]).reshape(-1, 1, 2)
+    errors = []
+    for T, H in zip(estimated, truths):
+        relativeEstimate = np.linalg.inv(estimated[0]) @ T
+        relativeTruth = truths[0] @ np.linalg.inv(H)
+        a = cv2.perspectiveTransform(corners, relativeEstimate)
+        b = cv2.perspectiveTransform(corners, relativeTruth)
+        errors.append(np.linalg.norm(a - b, axis=2).mean())
+    return float(np.mean(errors))
+
+
+def runCase(method, estimator, size, count, threshold, options):
+    images, truths = sweep(size, count)
+    with tempfile.TemporaryDirectory() as directory:
+        paths = []
+        for k, image in enumerate(images):
+            paths.append(os.path.join(directory, '%d.png' % k))
+            cv2.imwrite(paths[-1], image)
+        s = Stitching(
+            [method, estimator, threshold, False, False, '', False],
+            paths,
+            diagnostics=False,
+            **options,
+        )
+        metrics = s.run()
+    report = dict(
+        method=method,
+        estimator=estimator,
+        size=size,
+        count=count,
+        fail=s.fail,
+        seconds=metrics.total,
+        imagesPerSecond=count / metrics.total,
+        megapixelsPerSecond=count * size * size / 1e6 / metrics.total,
+        peakMemory=metrics.peakMemory,
+        stages=metrics.stages,
+        keypoints=int(np.mean([image['keypoints'] for image in metrics.images])),
+        inliers=int(np.mean([pair.get('inliers', 0) for pair in metrics.pairs])),
+        estimateSeconds=sum(pair.get('estimateTime', 0.0) for pair in metrics.pairs),
+    )
+    if not s.fail:
+        report['homographyError'] = cornerError(s.transforms, truths, size)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Time every detector on synthetic sweeps with known homographies.'
+    )
+    parser.add_argument(
+        '-m',
+        '--methods',
+        nargs='+',
+        default=['sift', 'orb', 'brisk', 'akaze', 'minutiae'],
+    )
+    parser.add_argument('-e', '--estimators', nargs='+', default=['ransac'])
+    parser.add_argument('-s', '--sizes', nargs='+', type=int, default=[512, 1024])
+    parser.add_argument('-c', '--counts', nargs='+', type=int, default=[3, 6])
+    parser.add_argument('-t', '--threshold', type=float, default=7.0)
+    parser.add_argument('--pyramid-levels', type=int, default=0)
+    parser.add_argument('--grayscale', action='store_true')
+    parser.add_argument('--overlap', action='store_true')
+    parser.add_argument('--adaptive', action='store_true')
+    parser.add_argument('--align', default='features', choices=['features', 'phase'])
+    parser.add_argument('--phase-rotation', action='store_true')
+    parser.add_argument(
+        '--max-error',
+        type=float,
+        help='report the fastest estimator within this corner error for every case',
+    )
+    parser.add_argument('--json', help='also write the reports to this file')
+    args = parser.parse_args(argv)
+    options = dict(
+        pyramidLevels=args.pyramid_levels,
+        grayscale=args.grayscale,
+        overlap=args.overlap,
+        adaptive=args.adaptive,
+        align=args.align,
+        phaseRotation=args.phase_rotation,
+    )
+
+    reports = []
+    header = ('method', 'estimator', 'size', 'count', 'seconds', 'est ms', 'img/s')
+    header += ('MP/s', 'peak MB', 'inliers', 'error px')
+    print('%-6s %-13s %6s %5s %9s %8s %8s %8s %9s %8s %9s' % header)
+    for method in args.methods:
+        for estimator in args.estimators:
+            for size in args.sizes:
+                for count in args.counts:
+                    # a fresh process per case so peak memory belongs to that case alone
+                    with ProcessPoolExecutor(max_workers=1) as pool:
+                        report = pool.submit(
+                            runCase,
+                            method,
+                            estimator,
+                            size,
+                            count,
+                            args.threshold,
+                            options,
+                        ).result()
+                    reports.append(report)
+                    print(
+                        '%-6s %-13s %6d %5d %9.3f %8.1f %8.2f %8.2f %9.1f %8d %9s'
+                        % (
+                            method,
+                            estimator,
+                            size,
+                            count,
+                            report['seconds'],
+                            report['estimateSeconds'] * 1000,
+                            report['imagesPerSecond'],
+                            report['megapixelsPerSecond'],
+                            (report['peakMemory'] or 0) / 2**20,
+                            report['inliers'],
+                            'failed'
+                            if report['fail']
+                            else '%.3f' % report['homographyError'],
+                        ),
+                        flush=True,
+                    )
+
+    if args.max_error is not None:
+        print()
+        cases = sorted({(r['method'], r['size'], r['count']) for r in reports})
+        for method, size, count in cases:
+            accurate = [
+                r
+                for r in reports
+                if (r['method'], r['size'], r['count']) == (method, size, count)
+                and not r['fail']
+                and r['homographyError'] <= args.max_error
+            ]
+            best = min(accurate, key=lambda r: r['estimateSeconds'], default=None)
+            print(
+                '%-6s %6d %5d fastest within %.2f px: %s'
+                % (
+                    method,
+                    size,
+                    count,
+                    args.max_error,
+                    best['estimator'] if best else 'none',
+                )
+            )
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            json.dump(reports, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+import hashlib
+import os
+
+import numpy as np
+
+FORMAT_VERSION = 2
+
+
+class FeatureCache:
+    # keypoints and descriptors are kept as two .npy files per entry so they can be
+    # memory-mapped back instead of copied, entries are evicted least recently used
+    # first once the directory grows past maxBytes
+    path = ''
+    maxBytes = 1 << 30
+
+    def __init__(self, path, maxBytes=1 << 30):
+        self.path = path
+        self.maxBytes = maxBytes
+        os.makedirs(path, exist_ok=True)
+
+    def key(self, digest, *config):
+        fields = [digest, str(FORMAT_VERSION)] + [repr(item) for item in config]
+        return hashlib.sha1('|'.join(fields).encode()).hexdigest()
+
+    def files(self, key):
+        return (
+            os.path.join(self.path, key + '.kp.npy'),
+            os.path.join(self.path, key + '.des.npy'),
+        )
+
+    def load(self, key):
+        kpPath, desPath = self.files(key)
+        try:
+            keypoints = np.load(kpPath, mmap_mode='r')
+            descriptors = np.load(desPath, mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+        # touching the entry is what keeps it at the young end of the LRU order
+        os.utime(kpPath)
+        os.utime(desPath)
+        if descriptors.size == 0:
+            descriptors = None
+        return keypoints, descriptors
+
+    def store(self, key, keypoints, descriptors):
+        if descriptors is None:
+            descriptors = np.empty((0, 0), np.uint8)
+        for path, array in zip(self.files(key), (keypoints, descriptors)):
+            # write aside and rename so concurrent readers never see a partial file
+            temp = '%s.%d.tmp' % (path, os.getpid())
+            with open(temp, 'wb') as file:
+                np.save(file, np.ascontiguousarray(array))
+            os.replace(temp, path)
+        self.evict()
+
+    def evict(self):
+        entries = {}
+        for name in os.listdir(self.path):
+            if not name.endswith('.npy'):
+                continue
+            stat = os.stat(os.path.join(self.path, name))
+            size, used = entries.get(name.split('.')[0], (0, 0))
+            entries[name.split('.')[0]] = (size + stat.st_size, max(used, stat.st_mtime))
+
+        total = sum(size for size, _ in entries.values())
+        for key, (size, _) in sorted(entries.items(), key=lambda item: item[1][1]):
+            if total <= self.maxBytes:
+                break
+            for path in self.files(key):
+                if os.path.exists(path):
+                    os.remove(path)
+            total -= size
@@ -0,0 +1,86 @@
+import cv2
+import numpy as np
+
+# seams are searched on copies of about this many pixels in total, then scaled back
+SEAM_MEGAPIXELS = 0.1
+# width of the transition between images, in percent of the mosaic's size
+BLEND_STRENGTH = 5
+
+
+def createSeamFinder(seams):
+    match seams:
+        case 'dp':
+            return cv2.detail_DpSeamFinder('COLOR_GRAD')
+        case 'graphcut':
+            return cv2.detail_GraphCutSeamFinder('COST_COLOR_GRAD')
+        case 'voronoi':
+            return cv2.detail.SeamFinder_createDefault(cv2.detail.SeamFinder_VORONOI_SEAM)
+        case _:
+            return None
+
+
+def createBlender(blending, width):
+    match blending:
+        case 'multiband':
+            blender = cv2.detail_MultiBandBlender()
+            blender.setNumBands(max(1, int(np.ceil(np.log2(width))) - 1))
+        case 'feather':
+            blender = cv2.detail_FeatherBlender()
+            blender.setSharpness(1 / width)
+        case _:
+            blender = cv2.detail.Blender_createDefault(cv2.detail.Blender_NO)
+    return blender
+
+
+def findSeams(warped, seams='dp'):
+    # warped holds (x, y, image, mask) footprints on the canvas. The seam finders only
+    # visit the overlap of each pair of footprints, and do so on downscaled copies,
+    # every mask is then cut back to its side of the seams
+    finder = createSeamFinder(seams)
+    masks = [mask for _, _, _, mask in warped]
+    if finder is None or len(warped) < 2:
+        return masks
+    area = sum(mask.size for mask in masks)
+    scale = min(1.0, np.sqrt(SEAM_MEGAPIXELS * 1e6 / area))
+    images, corners, smallMasks = [], [], []
+    for x, y, image, mask in warped:
+        if scale < 1.0:
+            image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        if image.ndim == 2:
+            image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+        images.append(image.astype(np.float32))
+        smallMasks.append(
+            cv2.resize(mask, image.shape[1::-1], interpolation=cv2.INTER_NEAREST)
+        )
+        corners.append((int(round(x * scale)), int(round(y * scale))))
+    found = finder.find(images, corners, smallMasks)
+
+    seamed = []
+    for mask, seam in zip(masks, found):
+        if isinstance(seam, cv2.UMat):
+            seam = seam.get()
+        # grow before upscaling so rounding never opens a gap along the seam
+        seam = cv2.resize(cv2.dilate(seam, None), mask.shape[::-1])
+        seamed.append(cv2.bitwise_and(seam, mask))
+    return seamed
+
+
+def composite(warped, blending='multiband', seams='dp'):
+    masks = findSeams(warped, seams)
+    left = min(x for x, _, _, _ in warped)
+    top = min(y for _, y, _, _ in warped)
+    right = max(x + image.shape[1] for x, _, image, _ in warped)
+    bottom = max(y + image.shape[0] for _, y, image, _ in warped)
+    width = max(1.0, np.sqrt((right - left) * (bottom - top)) * BLEND_STRENGTH / 100)
+
+    blender = createBlender(blending, width)
+    blender.prepare((left, top, right - left, bottom - top))
+    gray = warped[0][2].ndim == 2
+    for (x, y, image, _), mask in zip(warped, masks):
+        # the blenders take three channel 16 bit images only
+        if gray:
+            image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+        blender.feed(image.astype(np.int16), mask, (x, y))
+    result, _ = blender.blend(None, None)
+    result = np.clip(result, 0, 255).astype(np.uint8)
+    return cv2.cvtColor(result, cv2.COLOR_BGR2GRAY) if gray else result
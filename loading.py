@@ -0,0 +1,93 @@
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+# headerless 8 bit sensor dumps, their size has to be given as rawShape
+RAW_EXTENSIONS = ('.raw', '.bin')
+REDUCED_FLAGS = {
+    (1, False): cv2.IMREAD_COLOR,
+    (2, False): cv2.IMREAD_REDUCED_COLOR_2,
+    (4, False): cv2.IMREAD_REDUCED_COLOR_4,
+    (8, False): cv2.IMREAD_REDUCED_COLOR_8,
+    (1, True): cv2.IMREAD_GRAYSCALE,
+    (2, True): cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    (4, True): cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    (8, True): cv2.IMREAD_REDUCED_GRAYSCALE_8,
+}
+
+
+class ImageLoadError(OSError):
+    # every input that could not be read, as (path, reason) pairs
+    def __init__(self, problems):
+        self.problems = problems
+        super().__init__(
+            '; '.join('%s: %s' % (path, reason) for path, reason in problems)
+        )
+
+
+def conform(image, grayscale):
+    if grayscale and image.ndim == 3:
+        return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    if not grayscale and image.ndim == 2:
+        return cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+    return image
+
+
+def loadImage(path, grayscale=False, reduce=1, rawShape=None):
+    # returns the decoded image and the sha1 of the file, raising ImageLoadError
+    if (reduce, grayscale) not in REDUCED_FLAGS:
+        raise ValueError('reduce must be 1, 2, 4 or 8, not %r' % (reduce,))
+    if not os.path.isfile(path):
+        raise ImageLoadError([(path, 'no such file')])
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.npy' or extension in RAW_EXTENSIONS:
+        # mapped copy-on-write, pages are only read as the pipeline touches them and
+        # in place steps never write back to the file
+        try:
+            if extension == '.npy':
+                image = np.load(path, mmap_mode='c')
+            elif rawShape is None:
+                raise ValueError('rawShape is needed for raw sensor dumps')
+            else:
+                image = np.memmap(path, np.uint8, 'c', shape=tuple(rawShape))
+        except ValueError as e:
+            raise ImageLoadError([(path, str(e))]) from e
+        if image.dtype != np.uint8 or image.ndim not in (2, 3):
+            raise ImageLoadError([(path, 'expected 8 bit image data')])
+        digest = hashlib.sha1(np.ascontiguousarray(image)).hexdigest()
+        if reduce > 1:
+            image = cv2.resize(
+                image, None, fx=1 / reduce, fy=1 / reduce, interpolation=cv2.INTER_AREA
+            )
+        return conform(image, grayscale), digest
+
+    data = np.fromfile(path, np.uint8)
+    image = cv2.imdecode(data, REDUCED_FLAGS[reduce, grayscale])
+    if image is None:
+        raise ImageLoadError([(path, 'not a readable image')])
+    return image, hashlib.sha1(data).hexdigest()
+
+
+def loadImages(paths, grayscale=False, reduce=1, rawShape=None, workers=None):
+    # imdecode releases the GIL, so threads decode in parallel. Every failure is
+    # collected and reported together, nothing is skipped
+    def load(path):
+        try:
+            return loadImage(path, grayscale, reduce, rawShape)
+        except ImageLoadError as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=workers or min(8, len(paths) or 1)) as pool:
+        loaded = list(pool.map(load, paths))
+    problems = [
+        problem
+        for item in loaded
+        if isinstance(item, ImageLoadError)
+        for problem in item.problems
+    ]
+    if problems:
+        raise ImageLoadError(problems)
+    return [image for image, _ in loaded], [digest for _, digest in loaded]
@@ -0,0 +1,65 @@
+import json
+import sys
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def peakMemory():
+    # peak resident set size of this process in bytes, None when unknown
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports kilobytes, macOS bytes
+        return peak if sys.platform == 'darwin' else peak * 1024
+    try:
+        import psutil
+    except ImportError:
+        return None
+    info = psutil.Process().memory_info()
+    return getattr(info, 'peak_wset', info.rss)
+
+
+class Metrics:
+    def __init__(self):
+        self.stages = {}
+        self.images = []
+        self.pairs = []
+        self.total = 0.0
+        self.peakMemory = None
+
+    @contextmanager
+    def stage(self, name):
+        startPerf = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - startPerf
+            self.stages[name] = self.stages.get(name, 0.0) + elapsed
+            self.total += elapsed
+            self.peakMemory = peakMemory()
+
+    def addImage(self, index, **values):
+        self.images.append(dict(index=index, **values))
+
+    def addPair(self, pair, **values):
+        self.pairs.append(dict(pair=list(pair), **values))
+
+    def toDict(self):
+        return dict(
+            stages=self.stages,
+            total=self.total,
+            peakMemory=self.peakMemory,
+            images=self.images,
+            pairs=self.pairs,
+        )
+
+    def toJson(self, path=None):
+        text = json.dumps(self.toDict(), indent=2)
+        if path is not None:
+            with open(path, 'w', encoding='utf-8') as file:
+                file.write(text)
+        return text
@@ -0,0 +1,143 @@
+import cv2
+import numpy as np
+
+ENDING, BIFURCATION = 1, 3
+# neighbours described around every minutia and the spacing they are scaled by
+NEIGHBOURS = 4
+RIDGE_PERIOD = 9.0
+BORDER = 12
+# closer pairs are almost always spurs, bridges or breaks in the skeleton
+MIN_SEPARATION = 6.0
+
+
+def nearestNeighbours(points, k):
+    # k nearest other points and their distances. In two dimensions a KD-tree with a
+    # generous number of checks is as good as exact
+    index = cv2.flann_Index(points, dict(algorithm=1, trees=4))
+    indices, distances = index.knnSearch(points, k + 1, params=dict(checks=128))
+    return indices[:, 1:], np.sqrt(distances[:, 1:])
+
+
+def ridgeMap(gray):
+    # ridges (dark on light, as captured) become foreground
+    blurred = cv2.GaussianBlur(gray, (0, 0), 1.5)
+    block = int(2 * RIDGE_PERIOD) | 1
+    binary = cv2.adaptiveThreshold(
+        blurred, 1, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY_INV, block, 0
+    )
+    return cv2.morphologyEx(binary, cv2.MORPH_OPEN, np.ones((2, 2), np.uint8))
+
+
+def neighbourhood(image):
+    # the eight neighbours P2..P9 of Zhang-Suen, clockwise from north
+    padded = np.pad(image, 1)
+    height, width = image.shape
+    offsets = [(0, 1), (0, 2), (1, 2), (2, 2), (2, 1), (2, 0), (1, 0), (0, 0)]
+    return [padded[y : y + height, x : x + width] for y, x in offsets]
+
+
+def thin(binary):
+    # Zhang-Suen thinning on whole arrays, each pass peels one layer off every ridge
+    if hasattr(cv2, 'ximgproc'):
+        return cv2.ximgproc.thinning(binary * 255) // 255
+    skeleton = binary.astype(np.uint8).copy()
+    while True:
+        changed = False
+        for step in (0, 1):
+            p = neighbourhood(skeleton)
+            count = sum(p)
+            transitions = sum(
+                (p[k] == 0) & (p[(k + 1) % 8] == 1) for k in range(8)
+            )
+            if step == 0:
+                clear = (p[0] * p[2] * p[4] == 0) & (p[2] * p[4] * p[6] == 0)
+            else:
+                clear = (p[0] * p[2] * p[6] == 0) & (p[0] * p[4] * p[6] == 0)
+            remove = (
+                (skeleton == 1) & (count >= 2) & (count <= 6) & (transitions == 1) & clear
+            )
+            if remove.any():
+                skeleton[remove] = 0
+                changed = True
+        if not changed:
+            return skeleton
+
+
+def ridgeOrientation(gray):
+    # structure tensor orientation, the direction along the ridges in [0, pi)
+    gray = gray.astype(np.float32)
+    gx = cv2.Sobel(gray, cv2.CV_32F, 1, 0)
+    gy = cv2.Sobel(gray, cv2.CV_32F, 0, 1)
+    sigma = RIDGE_PERIOD / 2
+    gxx = cv2.GaussianBlur(gx * gx, (0, 0), sigma)
+    gyy = cv2.GaussianBlur(gy * gy, (0, 0), sigma)
+    gxy = cv2.GaussianBlur(gx * gy, (0, 0), sigma)
+    return np.mod(0.5 * np.arctan2(2 * gxy, gxx - gyy) + np.pi / 2, np.pi)
+
+
+def extractMinutiae(gray, mask=None):
+    # (x, y, orientation, type) rows for ridge endings and bifurcations, found by
+    # the crossing number of the skeleton
+    skeleton = thin(ridgeMap(gray))
+    p = neighbourhood(skeleton)
+    crossing = sum(np.abs(p[k].astype(np.int8) - p[(k + 1) % 8]) for k in range(8)) // 2
+    kinds = np.where(skeleton == 1, crossing, 0)
+    valid = np.zeros_like(skeleton, bool)
+    valid[BORDER:-BORDER, BORDER:-BORDER] = True
+    if mask is not None:
+        valid &= mask > 0
+    ys, xs = np.nonzero(((kinds == ENDING) | (kinds == BIFURCATION)) & valid)
+    points = np.float32(np.column_stack([xs, ys]))
+
+    if len(points) > 1:
+        keep = nearestNeighbours(points, 1)[1][:, 0] >= MIN_SEPARATION
+        points, ys, xs = points[keep], ys[keep], xs[keep]
+    orientation = ridgeOrientation(gray)[ys, xs]
+    return np.column_stack([points, orientation, kinds[ys, xs]]).astype(np.float32)
+
+
+def describe(minutiae):
+    # local structure of every minutia: its nearest neighbours by distance, the
+    # direction towards each and their orientation, all relative to its own ridge
+    # orientation, so the descriptor survives rotation and translation. Orientations
+    # are only known modulo pi, angles enter as doubled cosines and sines
+    count = len(minutiae)
+    descriptors = np.zeros((count, NEIGHBOURS * 6), np.float32)
+    if count < 2:
+        return descriptors
+    points, theta, kind = minutiae[:, :2], minutiae[:, 2], minutiae[:, 3]
+    k = min(NEIGHBOURS, count - 1)
+    nearest, d = nearestNeighbours(np.ascontiguousarray(points), k)
+    offsets = points[nearest] - points[:, None]
+    direction = np.arctan2(offsets[..., 1], offsets[..., 0])
+    relative = direction - theta[:, None]
+    turn = theta[nearest] - theta[:, None]
+    features = np.stack(
+        [
+            d / RIDGE_PERIOD,
+            np.cos(2 * relative),
+            np.sin(2 * relative),
+            np.cos(2 * turn),
+            np.sin(2 * turn),
+            (kind[nearest] == kind[:, None]).astype(np.float32),
+        ],
+        axis=2,
+    )
+    descriptors[:, : k * 6] = features.reshape(count, -1)
+    return descriptors
+
+
+class MinutiaeDetector:
+    # the detectAndCompute interface of the OpenCV feature detectors
+    def detectAndCompute(self, image, mask=None):
+        if image.ndim == 3:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        minutiae = extractMinutiae(image, mask)
+        keypoints = [
+            cv2.KeyPoint(
+                float(x), float(y), RIDGE_PERIOD, float(np.degrees(theta)), 0, 0, int(kind)
+            )
+            for x, y, theta, kind in minutiae
+        ]
+        # like the OpenCV detectors, nothing found means no descriptors at all
+        return keypoints, describe(minutiae) if len(minutiae) else None
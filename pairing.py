@@ -0,0 +1,75 @@
+import cv2
+import numpy as np
+
+
+class PairIndex:
+    # one approximate nearest-neighbour index over the descriptors of every image,
+    # a sample of each image's descriptors votes for the images its distinctive
+    # nearest neighbours come from, so ranking costs one index build and N * samples
+    # queries instead of a knnMatch per image pair
+    votes = None
+
+    def __init__(self, descriptors, samples=500, ratio=0.8, seed=0):
+        rng = np.random.default_rng(seed)
+        # a featureless capture takes an empty block shaped like everyone else's
+        present = [des for des in descriptors if des is not None]
+        width, dtype = 32, np.uint8
+        if present:
+            width, dtype = present[0].shape[1], present[0].dtype
+        descriptors = [
+            des if des is not None else np.empty((0, width), dtype)
+            for des in descriptors
+        ]
+        labels = np.concatenate(
+            [np.full(len(des), i, np.int32) for i, des in enumerate(descriptors)]
+        )
+        pool = np.concatenate(descriptors)
+        self.votes = np.zeros((len(descriptors), len(descriptors)), np.float32)
+        if len(pool) < 2:
+            # nothing to compare, every pair ranks the same
+            return
+        if pool.dtype == np.uint8:
+            index = cv2.flann_Index(
+                pool, dict(algorithm=6, table_number=6, key_size=12, multi_probe_level=1)
+            )
+        else:
+            index = cv2.flann_Index(np.float32(pool), dict(algorithm=1, trees=4))
+
+        for i, des in enumerate(descriptors):
+            if len(des) == 0:
+                continue
+            query = des[rng.choice(len(des), min(samples, len(des)), replace=False)]
+            if query.dtype != np.uint8:
+                query = np.float32(query)
+            # the query itself and near duplicates from its own image come back
+            # first, ask for a few extra neighbours and drop them
+            indices, distances = index.knnSearch(
+                query, min(4, len(pool)), params=dict(checks=32)
+            )
+            owners = np.where(indices >= 0, labels[np.maximum(indices, 0)], i)
+            distances = distances.astype(np.float32)
+            if query.dtype != np.uint8:
+                # KD-tree distances come back squared
+                distances = np.sqrt(distances)
+            distances = np.where(owners == i, np.inf, distances)
+            order = np.argsort(distances, axis=1)
+            best = np.take_along_axis(distances, order[:, :2], axis=1)
+            owner = np.take_along_axis(owners, order[:, :1], axis=1).ravel()
+            good = np.isfinite(best[:, 0]) & (best[:, 0] < ratio * best[:, 1])
+            np.add.at(self.votes[i], owner[good], 1)
+        self.votes += self.votes.T
+
+    def neighbours(self, k):
+        votes = self.votes.copy()
+        np.fill_diagonal(votes, -1)
+        k = min(k, len(votes) - 1)
+        return np.argsort(-votes, axis=1, kind='stable')[:, :k]
+
+    def pairs(self, k):
+        return sorted(
+            {
+                (min(i, int(j)), max(i, int(j)))
+                for i, row in enumerate(self.neighbours(k))
+                for j in row
+            }
+        )
@@ -0,0 +1,136 @@
+import cv2
+import numpy as np
+
+from warping import translation
+
+# below this peak response a pair goes through feature matching instead
+PHASE_MIN_RESPONSE = 0.05
+# rows of the log-polar spectrum, one per half degree
+ANGLE_BINS = 720
+# swipe captures barely turn, larger estimates are taken as noise
+MAX_ROTATION = 10.0
+ROTATION_PASSES = 2
+
+
+def prepare(image, size):
+    # gray, zero mean and tapered by a Hanning window so the image borders do not
+    # correlate with each other, then padded with zeros to size
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    image = image.astype(np.float32)
+    image -= image.mean()
+    height, width = image.shape
+    image *= cv2.createHanningWindow((width, height), cv2.CV_32F)
+    return cv2.copyMakeBorder(
+        image, 0, size[1] - height, 0, size[0] - width, cv2.BORDER_CONSTANT
+    )
+
+
+def polarSpectrum(image):
+    # the magnitude spectrum ignores translation, in polar coordinates a rotation of
+    # the image becomes a shift along the rows
+    spectrum = cv2.magnitude(*cv2.split(cv2.dft(image, flags=cv2.DFT_COMPLEX_OUTPUT)))
+    spectrum = np.fft.fftshift(np.log1p(spectrum))
+    height, width = spectrum.shape
+    centre = (width / 2, height / 2)
+    radius = min(centre)
+    return cv2.warpPolar(
+        spectrum,
+        (int(radius), ANGLE_BINS),
+        centre,
+        radius,
+        cv2.WARP_POLAR_LINEAR | cv2.INTER_LINEAR,
+    )
+
+
+def estimateRotation(a, b):
+    # degrees that b is rotated by against a, the spectrum is symmetric so only
+    # rotations within a quarter turn either way are told apart
+    (_, shift), _ = cv2.phaseCorrelate(polarSpectrum(a), polarSpectrum(b))
+    angle = shift * 360.0 / ANGLE_BINS
+    return (angle + 90.0) % 180.0 - 90.0
+
+
+def overlapCrops(a, b, dx, dy):
+    # the parts of a and b that the shift (dx, dy) lays over each other
+    dx, dy = int(round(dx)), int(round(dy))
+    x0, y0 = max(0, -dx), max(0, -dy)
+    x1 = min(a.shape[1], b.shape[1] - dx)
+    y1 = min(a.shape[0], b.shape[0] - dy)
+    if x1 - x0 < 2 or y1 - y0 < 2:
+        return None
+    return a[y0:y1, x0:x1], b[y0 + dy : y1 + dy, x0 + dx : x1 + dx], (x0 + dx, y0 + dy)
+
+
+def derotate(a, b, preparedA, size, dx, dy):
+    # the rotation is read from the overlap the shift lays out, elsewhere the two
+    # spectra share nothing. The shift is then correlated again without it, and the
+    # new overlap reads what rotation is left
+    R, unrotated, response = np.eye(3), b, None
+    for _ in range(ROTATION_PASSES):
+        crops = overlapCrops(a, unrotated, dx, dy)
+        if crops is None:
+            break
+        cropA, cropB, (x, y) = crops
+        # a square from the middle of the overlap, so both axes of the spectrum have
+        # the same frequency spacing and a rotation stays one
+        height, width = cropA.shape[:2]
+        side = min(width, height)
+        while cv2.getOptimalDFTSize(side) != side:
+            side -= 1
+        x0, y0 = (width - side) // 2, (height - side) // 2
+        cropA = cropA[y0 : y0 + side, x0 : x0 + side]
+        cropB = cropB[y0 : y0 + side, x0 : x0 + side]
+        angle = estimateRotation(
+            prepare(cropA, (side, side)), prepare(cropB, (side, side))
+        )
+        if abs(angle) > MAX_ROTATION:
+            break
+        step = np.eye(3)
+        centre = (x + width / 2, y + height / 2)
+        step[:2] = cv2.getRotationMatrix2D(centre, -angle, 1.0)
+        R = R @ step
+        unrotated = cv2.warpAffine(b, np.linalg.inv(R)[:2], b.shape[1::-1])
+        (dx, dy), response = cv2.phaseCorrelate(preparedA, prepare(unrotated, size))
+    return R @ translation(dx, dy), response
+
+
+def phaseAlign(a, b, rotation=False):
+    # the homography from a into b for captures that differ by a shift, and a small
+    # rotation with rotation=True, together with the correlation peak response. The
+    # correlation is circular, padding to twice the size keeps shifts of more than
+    # half an image from wrapping around
+    size = (
+        cv2.getOptimalDFTSize(2 * max(a.shape[1], b.shape[1])),
+        cv2.getOptimalDFTSize(2 * max(a.shape[0], b.shape[0])),
+    )
+    preparedA = prepare(a, size)
+    (dx, dy), response = cv2.phaseCorrelate(preparedA, prepare(b, size))
+    H = translation(dx, dy)
+    if rotation:
+        # a partial overlap can still fool the spectrum, the rotated result is only
+        # taken when it also correlates better
+        rotated, rotatedResponse = derotate(a, b, preparedA, size, dx, dy)
+        if rotatedResponse is not None and rotatedResponse > response:
+            H, response = rotated, rotatedResponse
+    return H, response
+
+
+def correspondences(H, shape, otherShape, spacing=32):
+    # a grid over the part of the first image that H carries into the second, with
+    # its images under H, so phase aligned pairs join the bundle adjustment like
+    # matched ones
+    height, width = shape[:2]
+    xs, ys = np.meshgrid(
+        np.arange(spacing / 2, width, spacing), np.arange(spacing / 2, height, spacing)
+    )
+    points = np.column_stack([xs.ravel(), ys.ravel()])
+    projected = cv2.perspectiveTransform(points.reshape(-1, 1, 2), H).reshape(-1, 2)
+    otherHeight, otherWidth = otherShape[:2]
+    inside = (
+        (projected[:, 0] >= 0)
+        & (projected[:, 0] < otherWidth)
+        & (projected[:, 1] >= 0)
+        & (projected[:, 1] < otherHeight)
+    )
+    return points[inside], projected[inside]
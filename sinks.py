@@ -0,0 +1,41 @@
+import os
+
+import cv2
+
+
+class MemorySink:
+    # keeps every artifact, diagnostics stay unrendered until Stitching.result asks
+    def __init__(self):
+        self.titles, self.results = [], []
+
+    def __call__(self, index, title, image):
+        self.titles.append(title)
+        self.results.append(image)
+
+
+class DirectorySink:
+    # writes each artifact as soon as it is produced and keeps nothing
+    def __init__(self, path, diagnostics=True, extension='.jpg'):
+        self.path = path
+        self.diagnostics = diagnostics
+        self.extension = extension
+        self.titles = []
+        os.makedirs(path, exist_ok=True)
+
+    def __call__(self, index, title, image):
+        if callable(image):
+            if not self.diagnostics:
+                return
+            image = image(1.0)
+        cv2.imwrite(os.path.join(self.path, str(index) + self.extension), image)
+        self.titles.append(title)
+
+
+class CallbackSink:
+    # hands each artifact to fn(index, title, image), rendering diagnostics first
+    def __init__(self, fn, scale=1.0):
+        self.fn = fn
+        self.scale = scale
+
+    def __call__(self, index, title, image):
+        self.fn(index, title, image(self.scale) if callable(image) else image)
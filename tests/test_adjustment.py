@@ -0,0 +1,84 @@
+import os
+
+import cv2
+import pytest
+
+from benchmark import cornerError, sweep
+from works import Stitching
+
+SIZE = 384
+
+
+def capture(directory, count, overlap, size=SIZE):
+    images, truths = sweep(size, count, overlap)
+    paths = []
+    for k, image in enumerate(images):
+        paths.append(os.path.join(directory, '%d.png' % k))
+        cv2.imwrite(paths[-1], image)
+    return paths, truths
+
+
+def stitch(paths, method, **options):
+    # RANSAC draws from OpenCV's global generator, seed it so both runs register
+    # the same inliers
+    cv2.setRNGSeed(0)
+    s = Stitching(
+        [method, 'ransac', 7.0, False, False, '', False],
+        paths,
+        diagnostics=False,
+        blending='average',
+        **options,
+    )
+    s.run()
+    assert not s.fail
+    return s
+
+
+# adjusted poses may move by the registration noise, not by whole pixels
+def assertNoWorse(adjusted, chain):
+    assert adjusted <= chain * 1.1 + 0.15
+
+
+@pytest.mark.parametrize('method', ['sift', 'brisk'])
+def test_adjustment_no_worse_than_spanning_tree(tmp_path, method):
+    # overlapping every other capture too, unordered matching closes cycles
+    paths, truths = capture(tmp_path, 5, 0.7)
+    tree = stitch(paths, method, ordered=False, adjust=False)
+    adjusted = stitch(paths, method, ordered=False)
+    assert len(adjusted.pairs) >= len(paths)
+    assertNoWorse(
+        cornerError(adjusted.transforms, truths, SIZE),
+        cornerError(tree.transforms, truths, SIZE),
+    )
+
+
+@pytest.mark.parametrize('method', ['sift', 'brisk'])
+def test_forced_adjustment_of_a_chain(tmp_path, method):
+    paths, truths = capture(tmp_path, 6, 0.5)
+    chain = stitch(paths, method, adjust=False)
+    adjusted = stitch(paths, method, adjust=True)
+    assertNoWorse(
+        cornerError(adjusted.transforms, truths, SIZE),
+        cornerError(chain.transforms, truths, SIZE),
+    )
+
+
+def test_chain_is_not_adjusted_by_default(tmp_path, monkeypatch):
+    import works
+
+    def fail(*args, **kwargs):
+        raise AssertionError('a chain has no cycle to adjust')
+
+    monkeypatch.setattr(works, 'adjustHomographies', fail)
+    stitch(capture(tmp_path, 3, 0.5)[0], 'sift')
+
+
+def test_adjustment_keeps_ecc_refinement(tmp_path):
+    # two pyramid levels leave the keypoints coarse, ECC makes the links exact
+    paths, truths = capture(tmp_path, 3, 0.5, 512)
+    refined = stitch(paths, 'sift', pyramidLevels=2, adjust=False)
+    adjusted = stitch(paths, 'sift', pyramidLevels=2, adjust=True)
+    assertNoWorse(
+        cornerError(adjusted.transforms, truths, 512),
+        cornerError(refined.transforms, truths, 512),
+    )
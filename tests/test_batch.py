@@ -0,0 +1,39 @@
+import json
+
+import cv2
+
+from batch import findSessions, main
+from benchmark import sweep
+
+
+def test_sessions_sort_naturally(tmp_path):
+    for k in (1, 2, 10, 11, 3):
+        (tmp_path / ('%d.jpg' % k)).touch()
+    (paths,) = findSessions(str(tmp_path)).values()
+    assert [path.rsplit('/', 1)[-1] for path in paths] == [
+        '1.jpg',
+        '2.jpg',
+        '3.jpg',
+        '10.jpg',
+        '11.jpg',
+    ]
+
+
+def test_metrics_peak_memory_is_per_session(tmp_path):
+    # one job, so without a worker per session the small one would report the
+    # high-water mark the large one left behind
+    manifest = {}
+    for name, size in (('large', 1024), ('small', 256)):
+        images, _ = sweep(size, 2)
+        manifest[name] = []
+        for k, image in enumerate(images):
+            manifest[name].append('%s%d.png' % (name, k))
+            cv2.imwrite(str(tmp_path / manifest[name][-1]), image)
+    (tmp_path / 'manifest.json').write_text(json.dumps(manifest))
+    output = tmp_path / 'results'
+    main([str(tmp_path / 'manifest.json'), '-o', str(output), '-j', '1', '--metrics'])
+    peaks = {
+        name: json.loads((output / name / 'metrics.json').read_text())['peakMemory']
+        for name in manifest
+    }
+    assert peaks['small'] < peaks['large']
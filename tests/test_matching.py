@@ -0,0 +1,88 @@
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+from benchmark import sweep
+from works import MatchResult, Stitching, knnMatch
+
+
+def binaryDescriptors(count, seed=0):
+    return np.random.default_rng(seed).integers(0, 256, (count, 32), np.uint8)
+
+
+def test_bf_hamming_matches_itself():
+    des = binaryDescriptors(50)
+    indices, distances = knnMatch('orb', des, des, 'bf')
+    assert distances.dtype == np.float32
+    assert (indices[:, 0] == np.arange(50)).all()
+    assert (distances[:, 0] == 0).all()
+
+
+@pytest.mark.parametrize('method', ['sift', 'orb'])
+def test_single_train_descriptor_is_no_match(method):
+    des = binaryDescriptors(5)
+    if method == 'sift':
+        des = des.astype(np.float32)
+    indices, distances = knnMatch(method, des, des[:1])
+    assert (indices == -1).all()
+    assert len(MatchResult(indices, distances)) == 0
+
+
+def test_akaze_sweep_stitches(tmp_path):
+    images, _ = sweep(256, 3)
+    paths = []
+    for k, image in enumerate(images):
+        paths.append(os.path.join(tmp_path, '%d.png' % k))
+        cv2.imwrite(paths[-1], image)
+    s = Stitching(
+        ['akaze', 'ransac', 7.0, False, False, '', False], paths, diagnostics=False
+    )
+    s.run()
+    assert not s.fail
+
+
+def test_wrong_overlap_hint_falls_back(tmp_path):
+    images, _ = sweep(256, 3)
+    paths = []
+    for k, image in enumerate(images):
+        paths.append(os.path.join(tmp_path, '%d.png' % k))
+        cv2.imwrite(paths[-1], image)
+    s = Stitching(
+        ['sift', 'ransac', 7.0, False, False, '', False],
+        paths,
+        diagnostics=False,
+        overlap=True,
+        overlapHint=(200, 0),
+    )
+    s.run()
+    assert not s.fail
+    assert s.completed
+
+
+def test_empty_query_is_no_match():
+    des = np.random.default_rng(0).random((5, 24), np.float32)
+    indices, distances = knnMatch('minutiae', des[:0], des)
+    assert indices.shape == distances.shape == (0, 2)
+    assert len(MatchResult(indices, distances)) == 0
+
+
+@pytest.mark.parametrize('ordered', [True, False])
+def test_blank_capture_with_minutiae(tmp_path, ordered):
+    images, _ = sweep(256, 2)
+    images.insert(0, np.full_like(images[0], 200))
+    paths = []
+    for k, image in enumerate(images):
+        paths.append(os.path.join(tmp_path, '%d.png' % k))
+        cv2.imwrite(paths[-1], image)
+    s = Stitching(
+        ['minutiae', 'ransac', 7.0, False, False, '', False],
+        paths,
+        diagnostics=False,
+        ordered=ordered,
+    )
+    s.run()
+    assert s.des[0] is None
+    # the blank capture cannot be placed, but the run ends cleanly
+    assert s.fail
@@ -0,0 +1,22 @@
+import numpy as np
+
+from pairing import PairIndex
+
+
+def test_featureless_capture_in_float_set():
+    rng = np.random.default_rng(0)
+    base = rng.random((200, 128), np.float32)
+    descriptors = [base, None, base + 0.01 * rng.random((200, 128), np.float32)]
+    assert (0, 2) in PairIndex(descriptors).pairs(1)
+
+
+def test_tiny_pool():
+    descriptors = [np.zeros((1, 61), np.uint8), np.ones((2, 61), np.uint8), None]
+    index = PairIndex(descriptors)
+    # the featureless capture gets no votes but is still paired
+    assert not index.votes[2].any() and not index.votes[:, 2].any()
+    assert index.pairs(2) == [(0, 1), (0, 2), (1, 2)]
+    # a single descriptor builds no index, every pair ranks the same
+    index = PairIndex([np.zeros((1, 61), np.uint8), None])
+    assert not index.votes.any()
+    assert index.pairs(1) == [(0, 1)]
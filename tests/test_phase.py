@@ -0,0 +1,48 @@
+import cv2
+import numpy as np
+import pytest
+
+from benchmark import ridgePattern
+from phase import PHASE_MIN_RESPONSE, phaseAlign
+from warping import translation
+
+SIZE = 384
+
+
+def rotatedPair(angle, shift=0.4):
+    # a and b cut from one pattern, b a shift of SIZE to the right of a and turned
+    # by angle about its own centre, with the homography from a into b
+    pattern = ridgePattern(3 * SIZE, 2 * SIZE, 1)
+    x0 = y0 = SIZE // 2
+    x1 = x0 + int(shift * SIZE)
+    R = np.eye(3)
+    R[:2] = cv2.getRotationMatrix2D((x1 + SIZE / 2, y0 + SIZE / 2), angle, 1.0)
+    turned = cv2.warpAffine(pattern, R[:2], pattern.shape[1::-1])
+    a = pattern[y0 : y0 + SIZE, x0 : x0 + SIZE]
+    b = turned[y0 : y0 + SIZE, x1 : x1 + SIZE]
+    return a, b, translation(-x1, -y0) @ R @ translation(x0, y0)
+
+
+def error(H, truth):
+    # over points of a that lie in the overlap
+    points = np.float32([[200, 100], [300, 200], [250, 300]]).reshape(-1, 1, 2)
+    return np.abs(
+        cv2.perspectiveTransform(points, H) - cv2.perspectiveTransform(points, truth)
+    ).max()
+
+
+@pytest.mark.parametrize('angle', [-2, 2, 3])
+def test_rotation_at_sweep_overlap(angle):
+    a, b, truth = rotatedPair(angle)
+    shifted, _ = phaseAlign(a, b)
+    H, response = phaseAlign(a, b, rotation=True)
+    assert response >= PHASE_MIN_RESPONSE
+    assert error(H, truth) < 1.0
+    assert error(shifted, truth) > 4.0
+
+
+def test_translation_is_kept_without_rotation():
+    a, b, truth = rotatedPair(0)
+    H, response = phaseAlign(a, b, rotation=True)
+    assert response >= PHASE_MIN_RESPONSE
+    assert error(H, truth) < 0.5
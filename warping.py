@@ -0,0 +1,112 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+import cv2
+import numpy as np
+
+TILE_SIZE = 1024
+
+
+def translation(x, y):
+    return np.array([[1, 0, x], [0, 1, y], [0, 0, 1]], dtype=np.float64)
+
+
+def bounds(shape, M):
+    # (left, top, right, bottom) of the image's footprint under M
+    height, width = shape[:2]
+    pts = np.float32([[0, 0], [width, 0], [width, height], [0, height]])
+    corners = cv2.perspectiveTransform(pts.reshape(-1, 1, 2), M).reshape(-1, 2)
+    left, top = np.floor(corners.min(axis=0)).astype(int)
+    right, bottom = np.ceil(corners.max(axis=0)).astype(int)
+    return int(left), int(top), int(right), int(bottom)
+
+
+@lru_cache(maxsize=8)
+def borderWeight(height, width):
+    # distance of every pixel to the image border. Weighting by it blends without
+    # looking at the neighbouring tiles, so tiles join without visible steps
+    y = np.minimum(np.arange(height), np.arange(height)[::-1]) + 1
+    x = np.minimum(np.arange(width), np.arange(width)[::-1]) + 1
+    return np.minimum.outer(y, x).astype(np.float32)
+
+
+def warpTile(image, M, tile):
+    # warp just the source region that lands in tile (left, top, right, bottom)
+    left, top, right, bottom = tile
+    pts = np.float32([[left, top], [right, top], [right, bottom], [left, bottom]])
+    source = cv2.perspectiveTransform(pts.reshape(-1, 1, 2), np.linalg.inv(M))
+    source = source.reshape(-1, 2)
+    height, width = image.shape[:2]
+    # two pixels of slack keep the interpolation at the tile edge inside the region
+    x0, y0 = np.clip(np.floor(source.min(axis=0)) - 2, 0, (width, height)).astype(int)
+    x1, y1 = np.clip(np.ceil(source.max(axis=0)) + 2, 0, (width, height)).astype(int)
+    if x1 <= x0 or y1 <= y0:
+        return None
+    M = translation(-left, -top) @ M @ translation(x0, y0)
+    size = (right - left, bottom - top)
+    warped = cv2.warpPerspective(image[y0:y1, x0:x1], M, size)
+    weight = cv2.warpPerspective(borderWeight(height, width)[y0:y1, x0:x1], M, size)
+    return warped, weight
+
+
+def renderTile(images, transforms, boxes, tile):
+    left, top, right, bottom = tile
+    total = weights = None
+    for image, M, (l, t, r, b) in zip(images, transforms, boxes):
+        if l >= right or r <= left or t >= bottom or b <= top:
+            continue
+        piece = warpTile(image, M, tile)
+        if piece is None:
+            continue
+        warped, weight = piece
+        if total is None:
+            total = np.zeros(warped.shape, np.float32)
+            weights = np.zeros(weight.shape, np.float32)
+        total += warped * (weight[..., None] if warped.ndim == 3 else weight)
+        weights += weight
+    if total is None:
+        return None
+    weights[weights == 0] = 1
+    return (total / (weights[..., None] if total.ndim == 3 else weights)).astype(
+        np.uint8
+    )
+
+
+def renderMosaic(images, transforms, tileSize=TILE_SIZE, out=None, workers=1):
+    # the canvas is the exact union of the footprints, rendered tile by tile so only
+    # one tile per worker is ever held in float. out may be an array, or a path for
+    # an .npy file that is memory mapped and filled in place
+    boxes = [bounds(image.shape, M) for image, M in zip(images, transforms)]
+    left = min(box[0] for box in boxes)
+    top = min(box[1] for box in boxes)
+    width = max(box[2] for box in boxes) - left
+    height = max(box[3] for box in boxes) - top
+    offset = translation(-left, -top)
+    transforms = [offset @ M for M in transforms]
+    boxes = [(l - left, t - top, r - left, b - top) for l, t, r, b in boxes]
+
+    shape = (height, width) + images[0].shape[2:]
+    if out is None:
+        out = np.zeros(shape, np.uint8)
+    elif isinstance(out, str):
+        out = np.lib.format.open_memmap(out, mode='w+', dtype=np.uint8, shape=shape)
+    tiles = [
+        (x, y, min(x + tileSize, width), min(y + tileSize, height))
+        for y in range(0, height, tileSize)
+        for x in range(0, width, tileSize)
+    ]
+
+    def render(tile):
+        x0, y0, x1, y1 = tile
+        rendered = renderTile(images, transforms, boxes, tile)
+        out[y0:y1, x0:x1] = 0 if rendered is None else rendered
+
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(render, tiles))
+    else:
+        for tile in tiles:
+            render(tile)
+    if isinstance(out, np.memmap):
+        out.flush()
+    return out
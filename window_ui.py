@@ -126,6 +126,7 @@ class Ui_MainWindow(object):
         self.comboBox_21.addItem("")
         self.comboBox_21.addItem("")
         self.comboBox_21.addItem("")
+        self.comboBox_21.addItem("")
         self.comboBox_21.setObjectName(u"comboBox_21")
 
         self.gridLayout_R.addWidget(self.comboBox_21, 1, 0, 1, 1, Qt.AlignHCenter)
@@ -145,12 +146,35 @@ class Ui_MainWindow(object):
         self.checkBox_13.setObjectName(u"checkBox_13")
         self.checkBox_13.setText(u"\u4fdd\u5b58\u7ed3\u679c")
 
-        self.gridLayout_R.addWidget(self.checkBox_13, 0, 2, 1, 1, Qt.AlignHCenter)
+        self.gridLayout_R.addWidget(self.checkBox_13, 0, 3, 1, 1, Qt.AlignHCenter)
 
         self.pushButton_25 = QPushButton(self.centralwidget)
         self.pushButton_25.setObjectName(u"pushButton_25")
 
-        self.gridLayout_R.addWidget(self.pushButton_25, 1, 2, 1, 1, Qt.AlignHCenter)
+        self.gridLayout_R.addWidget(self.pushButton_25, 1, 3, 1, 1, Qt.AlignHCenter)
+
+        self.pushButton_cancel = QPushButton(self.centralwidget)
+        self.pushButton_cancel.setObjectName(u"pushButton_cancel")
+        self.pushButton_cancel.setEnabled(False)
+
+        self.gridLayout_R.addWidget(self.pushButton_cancel, 1, 4, 1, 1, Qt.AlignHCenter)
+
+        self.label_14 = QLabel(self.centralwidget)
+        self.label_14.setObjectName(u"label_14")
+
+        self.gridLayout_R.addWidget(self.label_14, 0, 2, 1, 1, Qt.AlignHCenter)
+
+        self.comboBox_23 = QComboBox(self.centralwidget)
+        self.comboBox_23.addItem("")
+        self.comboBox_23.addItem("")
+        self.comboBox_23.addItem("")
+        self.comboBox_23.addItem("")
+        self.comboBox_23.addItem("")
+        self.comboBox_23.addItem("")
+        self.comboBox_23.addItem("")
+        self.comboBox_23.setObjectName(u"comboBox_23")
+
+        self.gridLayout_R.addWidget(self.comboBox_23, 1, 2, 1, 1, Qt.AlignHCenter)
 
 
         self.verticalLayout_R.addLayout(self.gridLayout_R)
@@ -211,10 +235,21 @@ class Ui_MainWindow(object):
         self.comboBox_21.setItemText(1, QCoreApplication.translate("MainWindow", u"ORB", None))
         self.comboBox_21.setItemText(2, QCoreApplication.translate("MainWindow", u"BRISK", None))
         self.comboBox_21.setItemText(3, QCoreApplication.translate("MainWindow", u"AKAZE", None))
+        self.comboBox_21.setItemText(4, QCoreApplication.translate("MainWindow", u"MINUTIAE", None))
 
         self.label_11.setText(QCoreApplication.translate("MainWindow", u"\u7279\u5f81\u70b9\u63d0\u53d6", None))
         self.label_12.setText(QCoreApplication.translate("MainWindow", u"RANSAC\u9608\u503c", None))
         self.pushButton_25.setText(QCoreApplication.translate("MainWindow", u"\u5f00\u59cb\u6f14\u793a", None))
+        self.pushButton_cancel.setText(QCoreApplication.translate("MainWindow", u"\u53d6\u6d88", None))
+        self.comboBox_23.setItemText(0, QCoreApplication.translate("MainWindow", u"RANSAC", None))
+        self.comboBox_23.setItemText(1, QCoreApplication.translate("MainWindow", u"MAGSAC", None))
+        self.comboBox_23.setItemText(2, QCoreApplication.translate("MainWindow", u"PROSAC", None))
+        self.comboBox_23.setItemText(3, QCoreApplication.translate("MainWindow", u"USAC_ACCURATE", None))
+        self.comboBox_23.setItemText(4, QCoreApplication.translate("MainWindow", u"USAC_FAST", None))
+        self.comboBox_23.setItemText(5, QCoreApplication.translate("MainWindow", u"LMEDS", None))
+        self.comboBox_23.setItemText(6, QCoreApplication.translate("MainWindow", u"RHO", None))
+
+        self.label_14.setText(QCoreApplication.translate("MainWindow", u"\u4f30\u8ba1\u65b9\u6cd5", None))
         self.label_title.setText("")
         self.label.setText("")
     # retranslateUi
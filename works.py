@@ -1,347 +1,1128 @@
+import hashlib
 import os
-import shutil
+import threading
 import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache, partial
 
 import cv2
 import matplotlib
 import numpy as np
 from matplotlib import pyplot as plt
 
+from adjustment import adjustHomographies
+from cache import FeatureCache
+from loading import conform, loadImages
+from compositing import composite
+from metrics import Metrics
+from minutiae import MinutiaeDetector
+from pairing import PairIndex
+from phase import PHASE_MIN_RESPONSE, correspondences, phaseAlign
+from sinks import MemorySink
+from warping import bounds, renderMosaic, translation
+
+_local = threading.local()
+
+CLAHE_CLIP_LIMIT, CLAHE_TILE_GRID = 3.0, (8, 8)
+DETECTOR_PARAMS = {
+    "sift": {},
+    "orb": {"maxFeatures": 15000},
+    "brisk": {},
+    "akaze": {},
+    "minutiae": {},
+}
+LSH_MIN_DESCRIPTORS = 2000
+GABOR_PARAMS = (15, 3.0, 10.0, 1.0, 8)  # ksize, sigma, wavelength, gamma, orientations
+# filter2D already switches to a DFT internally for mid-sized kernels, beyond this
+# size one shared forward transform for the whole bank is cheaper
+FFT_MIN_KERNEL = 31
+MIN_PAIR_INLIERS = 12
+# infos[1] names the robust estimator, the USAC flags need OpenCV 4.5 or later
+ESTIMATORS = {
+    name: getattr(cv2, flag)
+    for name, flag in [
+        ('ransac', 'RANSAC'),
+        ('lmeds', 'LMEDS'),
+        ('rho', 'RHO'),
+        ('usac', 'USAC_DEFAULT'),
+        ('usac_fast', 'USAC_FAST'),
+        ('usac_accurate', 'USAC_ACCURATE'),
+        ('usac_parallel', 'USAC_PARALLEL'),
+        ('magsac', 'USAC_MAGSAC'),
+        ('prosac', 'USAC_PROSAC'),
+    ]
+    if hasattr(cv2, flag)
+}
+ADAPTIVE_MIN_THRESHOLD = 1.0
+# slack around a predicted overlap, as a fraction of the other image's size
+OVERLAP_MARGIN = 0.1
+
+
+@lru_cache(maxsize=16)
+def gaborBank(ksize, sigma, wavelength, gamma, orientations):
+    kernels = []
+    for theta in np.arange(orientations) * np.pi / orientations:
+        kernel = cv2.getGaborKernel(
+            (ksize, ksize), sigma, theta, wavelength, gamma, 0, ktype=cv2.CV_32F
+        )
+        # zero mean so flat background gives no response
+        kernels.append(kernel - kernel.mean())
+    return tuple(kernels)
+
+
+# full frame spectra are large, a session's captures share one shape anyway
+@lru_cache(maxsize=1)
+def gaborSpectra(shape, params):
+    spectra = []
+    for kernel in gaborBank(*params):
+        padded = np.zeros(shape, np.float32)
+        padded[: kernel.shape[0], : kernel.shape[1]] = kernel
+        spectra.append(cv2.dft(padded))
+    return tuple(spectra)
+
+
+def enhanceRidges(image, params=GABOR_PARAMS, workers=1):
+    # maximum response over a bank of oriented Gabor filters
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    image = image.astype(np.float32)
+    ksize = params[0]
+
+    if ksize >= FFT_MIN_KERNEL:
+        r = ksize // 2
+        height, width = image.shape
+        padded = cv2.copyMakeBorder(image, r, r, r, r, cv2.BORDER_REFLECT_101)
+        shape = (
+            cv2.getOptimalDFTSize(height + 4 * r),
+            cv2.getOptimalDFTSize(width + 4 * r),
+        )
+        spectrum = cv2.dft(
+            cv2.copyMakeBorder(
+                padded, 0, shape[0] - height - 2 * r, 0, shape[1] - width - 2 * r,
+                cv2.BORDER_CONSTANT,
+            )
+        )
+
+        def respond(kernelSpectrum):
+            response = cv2.idft(
+                cv2.mulSpectrums(spectrum, kernelSpectrum, 0),
+                flags=cv2.DFT_SCALE | cv2.DFT_REAL_OUTPUT,
+            )
+            return response[2 * r : 2 * r + height, 2 * r : 2 * r + width]
+
+        kernels = gaborSpectra(shape, params)
+    else:
+
+        def respond(kernel):
+            return cv2.filter2D(image, cv2.CV_32F, kernel)
+
+        kernels = gaborBank(*params)
+
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            responses = list(pool.map(respond, kernels))
+    else:
+        responses = [respond(kernel) for kernel in kernels]
+    response = responses[0]
+    for other in responses[1:]:
+        np.maximum(response, other, out=response)
+    return cv2.normalize(response, None, 0, 255, cv2.NORM_MINMAX, cv2.CV_8U)
+
+
+def createDetector(method):
+    match method:
+        case "sift":
+            return cv2.SIFT_create()
+        case "orb":
+            orb = cv2.ORB_create()
+            orb.setMaxFeatures(DETECTOR_PARAMS["orb"]["maxFeatures"])
+            return orb
+        case "brisk":
+            return cv2.BRISK_create()
+        case "minutiae":
+            return MinutiaeDetector()
+        case _:
+            return cv2.AKAZE_create()
+
+
+def detectFeatures(image, method, level=0, mask=None, reduced=False):
+    # every worker thread (or process) keeps its own detector per method
+    detectors = getattr(_local, 'detectors', None)
+    if detectors is None:
+        detectors = _local.detectors = {}
+    if method not in detectors:
+        detectors[method] = createDetector(method)
+
+    startPerf = time.perf_counter()
+    # a reduced image was decoded at the coarse level already
+    for _ in range(0 if reduced else level):
+        image = cv2.pyrDown(image)
+    if mask is not None and mask.shape != image.shape[:2]:
+        mask = cv2.resize(mask, image.shape[1::-1], interpolation=cv2.INTER_NEAREST)
+    keypoints, descriptors = detectors[method].detectAndCompute(image, mask)
+    endPerf = time.perf_counter()
+    # plain (x, y, size, angle) rows pickle cheaply across process boundaries
+    keypoints = np.float32(
+        [(*kp.pt, kp.size, kp.angle) for kp in keypoints]
+    ).reshape(-1, 4)
+    # report coarse pyramid detections in full-resolution coordinates
+    keypoints[:, :3] *= 2**level
+    return keypoints, descriptors, endPerf - startPerf
+
+
+def expandedCorners(shape, margin=OVERLAP_MARGIN):
+    height, width = shape[:2]
+    left, top = -margin * width, -margin * height
+    right, bottom = (1 + margin) * width, (1 + margin) * height
+    return np.float32([[left, top], [right, top], [right, bottom], [left, bottom]])
+
+
+def overlapMask(shape, H, otherShape, margin=OVERLAP_MARGIN):
+    # pixels of an image of this shape that H carries into the other image
+    corners = cv2.perspectiveTransform(
+        expandedCorners(otherShape, margin).reshape(-1, 1, 2), np.linalg.inv(H)
+    )
+    mask = np.zeros(shape[:2], np.uint8)
+    cv2.fillConvexPoly(mask, np.round(corners).astype(np.int32).reshape(-1, 2), 255)
+    return mask
+
+
+def insideOverlap(points, H, otherShape, margin=OVERLAP_MARGIN):
+    # which points H carries into the other image
+    if len(points) == 0:
+        return np.zeros(0, bool)
+    projected = cv2.perspectiveTransform(
+        points.reshape(-1, 1, 2).astype(np.float64), H
+    ).reshape(-1, 2)
+    corners = expandedCorners(otherShape, margin)
+    return np.all((projected >= corners[0]) & (projected <= corners[2]), axis=1)
+
+
+def estimateHomography(
+    src, dst, estimator='ransac', threshold=3.0, confidence=0.995, maxIters=2000
+):
+    if estimator not in ESTIMATORS:
+        raise ValueError(
+            'unknown estimator %r, expected one of %s'
+            % (estimator, ', '.join(sorted(ESTIMATORS)))
+        )
+    return cv2.findHomography(
+        src,
+        dst,
+        ESTIMATORS[estimator],
+        threshold,
+        maxIters=maxIters,
+        confidence=confidence,
+    )
+
+
+def adaptInliers(src, dst, H, mask, ceiling):
+    # shrink the threshold to the noise of this pair: the median inlier residual of
+    # isotropic Gaussian noise is 1.1774 sigma, keep what is within the 99% radius
+    # of 3.03 sigma and refit on those by least squares
+    residuals = np.linalg.norm(cv2.perspectiveTransform(src, H) - dst, axis=2).ravel()
+    inliers = mask.ravel().astype(bool)
+    if np.count_nonzero(inliers) < MIN_PAIR_INLIERS:
+        return H, mask, ceiling
+    sigma = np.median(residuals[inliers]) / 1.1774
+    threshold = float(np.clip(3.03 * sigma, ADAPTIVE_MIN_THRESHOLD, ceiling))
+    inliers = residuals < threshold
+    if np.count_nonzero(inliers) < MIN_PAIR_INLIERS:
+        return H, mask, ceiling
+    refined, _ = cv2.findHomography(src[inliers], dst[inliers], 0)
+    if refined is None:
+        return H, mask, ceiling
+    return refined, inliers.astype(np.uint8).reshape(-1, 1), threshold
+
+
+def refineHomography(template, image, H, iterations=50, epsilon=1e-4):
+    # ECC maps template coordinates into image coordinates, the same direction as H
+    if template.ndim == 3:
+        template = cv2.cvtColor(template, cv2.COLOR_BGR2GRAY)
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    warp = (H / H[2, 2]).astype(np.float32)
+    try:
+        _, warp = cv2.findTransformECC(
+            template,
+            image,
+            warp,
+            cv2.MOTION_HOMOGRAPHY,
+            (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, iterations, epsilon),
+            None,
+            5,
+        )
+    except cv2.error:
+        # ECC did not converge, keep the coarse estimate
+        return H
+    return warp.astype(np.float64)
+
+
+def knnMatch(method, queryDescriptors, trainDescriptors, matcher='auto'):
+    # returns (indices, distances) arrays of the two nearest train descriptors per
+    # query, a missing neighbour is reported as index -1
+    if len(trainDescriptors) < 2 or len(queryDescriptors) == 0:
+        # the ratio test needs two neighbours, and FLANN asserts without them or
+        # returns nothing for an empty query
+        count = len(queryDescriptors)
+        return np.full((count, 2), -1, np.int32), np.full((count, 2), np.inf, np.float32)
+    if method in ("sift", "minutiae"):
+        # KD-tree over float descriptors, FLANN reports squared L2 distances
+        index = cv2.flann_Index(trainDescriptors, dict(algorithm=1, trees=5))
+        indices, distances = index.knnSearch(queryDescriptors, 2, params=dict(checks=50))
+        return indices, np.sqrt(distances)
+    # ORB, BRISK and AKAZE produce bit strings, compare them by Hamming distance,
+    # exhaustively for small sets and through LSH tables once brute force gets costly
+    size = min(len(queryDescriptors), len(trainDescriptors))
+    if matcher == 'lsh' or (matcher == 'auto' and size > LSH_MIN_DESCRIPTORS):
+        index = cv2.flann_Index(
+            trainDescriptors,
+            dict(algorithm=6, table_number=6, key_size=12, multi_probe_level=1),
+        )
+        indices, distances = index.knnSearch(queryDescriptors, 2, params=dict(checks=50))
+        return indices, distances.astype(np.float32)
+    # batchDistance only counts Hamming distances into integers
+    distances, indices = cv2.batchDistance(
+        queryDescriptors, trainDescriptors, cv2.CV_32S, normType=cv2.NORM_HAMMING, K=2
+    )
+    return indices, distances.astype(np.float32)
+
+
+class MatchResult:
+    queryIdx, trainIdx = None, None
+    distances, ratios = None, None
+    inliers = None
+    meanError, stdError = 0.0, 0.0
+    correspondences = None
+
+    def __init__(self, indices, distances, ratio=0.75):
+        valid = (indices[:, 0] >= 0) & (indices[:, 1] >= 0)
+        good = valid & (distances[:, 0] < ratio * distances[:, 1])
+        self.queryIdx = np.flatnonzero(good).astype(np.int32)
+        self.trainIdx = indices[good, 0].astype(np.int32)
+        self.distances = distances[good, 0]
+        # lower is more distinctive, PROSAC-style estimators want this order
+        self.ratios = self.distances / np.maximum(distances[good, 1], 1e-6)
+        self.inliers = np.zeros(len(self.queryIdx), bool)
+        self.restricted = False
+        self.threshold = None
+        self.estimateTime = 0.0
+        # point pairs of a phase correlated link, which has no matched keypoints
+        self.correspondences = None
+
+    def __len__(self):
+        return len(self.queryIdx)
+
+    def reorder(self, order):
+        self.queryIdx = self.queryIdx[order]
+        self.trainIdx = self.trainIdx[order]
+        self.distances = self.distances[order]
+        self.ratios = self.ratios[order]
+        self.inliers = self.inliers[order]
+
+    def points(self, queryKeypoints, trainKeypoints):
+        return (
+            queryKeypoints[self.queryIdx, :2].reshape(-1, 1, 2),
+            trainKeypoints[self.trainIdx, :2].reshape(-1, 1, 2),
+        )
+
+    def toDMatches(self):
+        return [
+            cv2.DMatch(int(q), int(t), float(d))
+            for q, t, d in zip(self.queryIdx, self.trainIdx, self.distances)
+        ]
+
+
+def putLines(image, lines, scale=1.0):
+    for k, line in enumerate(lines):
+        image = cv2.putText(
+            image,
+            line,
+            (int(10 * scale), int(60 * (k + 1) * scale)),
+            cv2.FONT_HERSHEY_DUPLEX,
+            2 * scale,
+            (0, 0, 255),
+            max(1, round(3 * scale)),
+        )
+    return image
+
+
+def sized(render, width, height):
+    # tells viewers what render(1.0) measures, so they can pick a scale first
+    render.size = (width, height)
+    return render
+
+
+def toKeyPoints(keypoints):
+    return [
+        cv2.KeyPoint(float(x), float(y), float(size), float(angle))
+        for x, y, size, angle in keypoints
+    ]
+
 
 class Stitching:
     images, imagePaths = [], []
     infos = []
-    results = []
+    results, titles = [], []
     kps, des = [], []
     Hs, masks = [], []
-    # inlierCounts, outlierCounts, stdErrs = [], [], []
+    pairs, matches = [], []
     fail = False
+    workers, executor = 1, 'thread'
+    cache, digests = None, []
+    matcher = 'auto'
+    pyramidLevels, refine = 0, 'ecc'
+    outputDir = 'results'
+    ordered, neighbours = True, 3
+    adjust, reference = None, 0
+    diagnostics, elapsed = True, []
+    sink, emitted = None, 0
+    progress, cancelled = None, False
+    metrics, transforms = None, []
+    enhanced, grayscale = [], False
+    overlap, overlapHint, completed = False, None, set()
+    confidence, maxIters, adaptive = 0.995, 2000, False
+    blending, seams = 'multiband', 'dp'
+    tileSize, canvasPath = None, None
+    reduce, rawShape = 1, None
+    coarse = []
+    align, phaseRotation, correlated = 'features', False, {}
 
-    def __init__(self, infos, imagePaths):
+    def __init__(
+        self,
+        infos,
+        imagePaths,
+        workers=1,
+        executor='thread',
+        cache=None,
+        matcher='auto',
+        pyramidLevels=0,
+        refine='ecc',
+        outputDir='results',
+        ordered=True,
+        neighbours=3,
+        adjust=None,
+        diagnostics=True,
+        sink=None,
+        progress=None,
+        grayscale=False,
+        overlap=False,
+        overlapHint=None,
+        confidence=0.995,
+        maxIters=2000,
+        adaptive=False,
+        blending='multiband',
+        seams='dp',
+        tileSize=None,
+        canvasPath=None,
+        reduce=1,
+        rawShape=None,
+        align='features',
+        phaseRotation=False,
+    ):
         self.images, self.imagePaths = [], []
         self.infos = []
-        self.results = []
+        self.results, self.titles = [], []
         self.kps, self.des = [], []
         self.Hs, self.masks = [], []
-        # self.inlierCounts, self.outlierCounts, self.stdErrs = [], [], []
+        self.pairs, self.matches = [], []
         self.infos = infos
         self.imagePaths = imagePaths
         self.fail = False
+        self.workers = workers
+        self.executor = executor
+        self.cache = FeatureCache(cache) if isinstance(cache, str) else cache
+        self.digests = []
+        self.matcher = matcher
+        self.pyramidLevels = pyramidLevels
+        self.refine = refine
+        self.outputDir = outputDir
+        self.ordered = ordered
+        self.neighbours = neighbours
+        # None adjusts only when the match graph has a cycle, a plain chain has
+        # nothing for the adjustment to reconcile
+        self.adjust = adjust
+        self.diagnostics = diagnostics
+        self.elapsed = []
+        self.sink = MemorySink() if sink is None else sink
+        if isinstance(self.sink, MemorySink):
+            self.results, self.titles = self.sink.results, self.sink.titles
+        self.emitted = 0
+        self.progress = progress
+        self.cancelled = False
+        self.metrics = Metrics()
+        self.transforms = []
+        self.enhanced = []
+        self.reference = 0
+        self.grayscale = grayscale
+        self.overlap = overlap
+        # a hint is the homography from each capture into the next, or just the
+        # (dx, dy) shift of the content between them
+        if overlapHint is not None and np.shape(overlapHint) == (2,):
+            overlapHint = np.array(
+                [[1, 0, overlapHint[0]], [0, 1, overlapHint[1]], [0, 0, 1]]
+            )
+        self.overlapHint = (
+            None if overlapHint is None else np.asarray(overlapHint, np.float64)
+        )
+        # images whose masked detection was completed for a fallback match
+        self.completed = set()
+        self.confidence = confidence
+        self.maxIters = maxIters
+        self.adaptive = adaptive
+        self.blending = blending
+        self.seams = seams
+        # large mosaics render tile by tile, optionally into a memory mapped .npy.
+        # Tiles are feathered by border distance, blending and seams do not apply
+        if canvasPath is not None and not tileSize:
+            raise ValueError('canvasPath needs tileSize')
+        if tileSize and (blending != 'multiband' or seams != 'dp'):
+            raise ValueError('tileSize renders with its own blending and no seams')
+        self.tileSize = tileSize
+        self.canvasPath = canvasPath
+        # reduce decodes at 1/2, 1/4 or 1/8 size for coarse passes, rawShape gives
+        # (height, width) of headerless sensor dumps
+        self.reduce = reduce
+        self.rawShape = rawShape
+        self.coarse = []
+        # align='phase' registers near translational sweeps by phase correlation and
+        # only matches features for the pairs it cannot place
+        self.align = align
+        self.phaseRotation = phaseRotation
+        self.correlated = {}
 
         self.readImages()
 
     def histogramEqualization(self):
-        for i in range(len(self.images)):
-            lab = cv2.cvtColor(self.images[i], cv2.COLOR_BGR2LAB)
-            l, a, b = cv2.split(lab)
-            clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))
-            cl = clahe.apply(l)
-            clahe_l = cv2.merge((cl, a, b))
-            self.images[i] = cv2.cvtColor(clahe_l, cv2.COLOR_LAB2BGR)
+        clahe = cv2.createCLAHE(clipLimit=CLAHE_CLIP_LIMIT, tileGridSize=CLAHE_TILE_GRID)
+        for images in (self.images, self.coarse):
+            for i in range(len(images)):
+                if images[i] is None:
+                    continue
+                if images[i].ndim == 2:
+                    clahe.apply(images[i], images[i])
+                    continue
+                lab = cv2.cvtColor(images[i], cv2.COLOR_BGR2LAB)
+                l, a, b = cv2.split(lab)
+                cl = clahe.apply(l)
+                clahe_l = cv2.merge((cl, a, b))
+                images[i] = cv2.cvtColor(clahe_l, cv2.COLOR_LAB2BGR)
+
+    def featureKey(self, index, method):
+        return self.cache.key(
+            self.digests[index],
+            method,
+            DETECTOR_PARAMS.get(method),
+            CLAHE_CLIP_LIMIT,
+            CLAHE_TILE_GRID,
+            self.pyramidLevels,
+            GABOR_PARAMS if self.infos[4] else None,
+            self.grayscale,
+            self.reduce,
+            self.maskDigest(index),
+            self.detectionImage(index)[1],
+            cv2.__version__,
+        )
 
     def findFeatures(self):
-        method = self.infos[0]
-        for image in self.images:
-            keypoints, descriptors = None, None
-            startPerf = time.perf_counter()
-            match method:
-                case "sift":
-                    sift = cv2.SIFT_create()
-                    keypoints, descriptors = sift.detectAndCompute(image, None)
-                case "orb":
-                    orb = cv2.ORB_create()
-                    orb.setMaxFeatures(15000)
-                    keypoints, descriptors = orb.detectAndCompute(image, None)
-                    descriptors = descriptors.astype(np.float32)
-                case "brisk":
-                    brisk = cv2.BRISK_create()
-                    keypoints, descriptors = brisk.detectAndCompute(image, None)
-                    descriptors = descriptors.astype(np.float32)
-                case "akaze":
-                    akaze = cv2.AKAZE_create()
-                    keypoints, descriptors = akaze.detectAndCompute(image, None)
-                    descriptors = descriptors.astype(np.float32)
-                case _:
-                    akaze = cv2.AKAZE_create()
-                    keypoints, descriptors = akaze.detectAndCompute(image, None)
-            endPerf = time.perf_counter()
-
-            image = cv2.drawKeypoints(
-                image, keypoints, None, flags=cv2.DRAW_MATCHES_FLAGS_DEFAULT,color=(0, 255, 0)
+        method = self.infos[0].lower()
+        features = [None] * len(self.images)
+        # images whose every link was phase correlated need no features at all
+        needed = set(range(len(self.images)))
+        if self.correlated:
+            needed = {
+                i
+                for pair in self.selectPairs()
+                if pair not in self.correlated
+                for i in pair
+            }
+            for i in set(range(len(self.images))) - needed:
+                features[i] = (np.zeros((0, 4), np.float32), None, 0.0)
+        if self.cache is not None:
+            for i in sorted(needed):
+                startPerf = time.perf_counter()
+                cached = self.cache.load(self.featureKey(i, method))
+                if cached is not None:
+                    features[i] = (*cached, time.perf_counter() - startPerf)
+        cached = [
+            features[i] is not None and i in needed for i in range(len(self.images))
+        ]
+        missing = [i for i in range(len(self.images)) if features[i] is None]
+
+        images = [self.detectionImage(i)[0] for i in missing]
+        reduced = [self.detectionImage(i)[1] for i in missing]
+        masks = [self.detectionMask(i) for i in missing]
+        if self.workers > 1 and len(missing) > 1:
+            poolClass = (
+                ProcessPoolExecutor if self.executor == 'process' else ThreadPoolExecutor
             )
-            image = cv2.putText(
-                image,
-                'method: ' + method,
-                (10, 60),
-                cv2.FONT_HERSHEY_DUPLEX,
-                2,
-                (0, 0, 255),
-                3,
+            with poolClass(max_workers=self.workers) as pool:
+                detected = list(
+                    pool.map(
+                        detectFeatures,
+                        images,
+                        [method] * len(images),
+                        [self.pyramidLevels] * len(images),
+                        masks,
+                        reduced,
+                    )
+                )
+        else:
+            detected = [
+                detectFeatures(image, method, self.pyramidLevels, mask, flag)
+                for image, mask, flag in zip(images, masks, reduced)
+            ]
+        for i, (keypoints, descriptors, elapsed) in zip(missing, detected):
+            features[i] = (keypoints, descriptors, elapsed)
+            if self.cache is not None:
+                self.cache.store(self.featureKey(i, method), keypoints, descriptors)
+
+        for i, (keypoints, descriptors, elapsed) in enumerate(features):
+            self.kps.append(keypoints)
+            self.des.append(descriptors)
+            self.elapsed.append(elapsed)
+            self.metrics.addImage(
+                i, time=elapsed, keypoints=len(keypoints), cached=cached[i]
             )
-            image = cv2.putText(
-                image,
-                'features: ' + str(len(keypoints)),
-                (10, 120),
-                cv2.FONT_HERSHEY_DUPLEX,
-                2,
-                (0, 0, 255),
-                3,
+            if self.diagnostics and i in needed:
+                height, width = self.images[i].shape[:2]
+                self.addResult(
+                    '特征点 图%d' % (i + 1),
+                    sized(partial(self.renderKeypoints, i), width, height),
+                )
+
+    def detectionImage(self, i):
+        # the image features are detected on, and whether it was decoded at the
+        # coarse pyramid level already
+        if self.enhanced:
+            return self.enhanced[i], False
+        if self.coarse:
+            return self.coarse[i], True
+        return self.images[i], False
+
+    def maskDetection(self):
+        return self.overlap and self.ordered and self.overlapHint is not None
+
+    def maskDigest(self, i):
+        # the mask depends on the image's place in the sequence and its neighbours,
+        # not only on the hint
+        mask = self.detectionMask(i)
+        return None if mask is None else hashlib.sha1(mask).hexdigest()
+
+    def completeFeatures(self, i):
+        # add the features outside the hinted strips, so a poor hint can still fall
+        # back to matching everything. Appending keeps the indices of matches
+        # already made against image i
+        mask = self.detectionMask(i)
+        if mask is None or i in self.completed:
+            return
+        self.completed.add(i)
+        image, reduced = self.detectionImage(i)
+        keypoints, descriptors, elapsed = detectFeatures(
+            image,
+            self.infos[0].lower(),
+            self.pyramidLevels,
+            cv2.bitwise_not(mask),
+            reduced,
+        )
+        self.elapsed[i] += elapsed
+        if descriptors is None:
+            return
+        self.kps[i] = np.concatenate([self.kps[i], keypoints])
+        if self.des[i] is not None:
+            descriptors = np.concatenate([self.des[i], descriptors])
+        self.des[i] = descriptors
+
+    def detectionMask(self, i):
+        # with a hint, only the strips shared with the neighbouring captures
+        if not self.maskDetection():
+            return None
+        shape = self.images[i].shape
+        mask = np.zeros(shape[:2], np.uint8)
+        if i + 1 < len(self.images):
+            mask |= overlapMask(shape, self.overlapHint, self.images[i + 1].shape)
+        if i > 0:
+            mask |= overlapMask(
+                shape, np.linalg.inv(self.overlapHint), self.images[i - 1].shape
             )
-            image = cv2.putText(
-                image,
-                'time: ' + str('{:.2f}'.format((endPerf - startPerf) * 1000)) + 'ms',
-                (10, 180),
-                cv2.FONT_HERSHEY_DUPLEX,
-                2,
-                (0, 0, 255),
-                3,
+        return mask
+
+    def renderKeypoints(self, i, scale=1.0):
+        image, keypoints = self.images[i], self.kps[i]
+        if scale != 1.0:
+            image = cv2.resize(
+                image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA
             )
-            self.results.append(image)
-            self.kps.append(keypoints)
-            self.des.append(descriptors)
+            keypoints = keypoints * np.float32([scale, scale, scale, 1])
+        image = cv2.drawKeypoints(
+            image,
+            toKeyPoints(keypoints),
+            None,
+            flags=cv2.DRAW_MATCHES_FLAGS_DEFAULT,
+            color=(0, 255, 0),
+        )
+        return putLines(
+            image,
+            [
+                'method: ' + self.infos[0].lower(),
+                'features: ' + str(len(self.kps[i])),
+                'time: ' + str('{:.2f}'.format(self.elapsed[i] * 1000)) + 'ms',
+            ],
+            scale,
+        )
+
+    def selectPairs(self):
+        if self.ordered:
+            return [(i, i + 1) for i in range(len(self.images) - 1)]
+        # unordered captures, only verify each image against its most similar ones
+        return PairIndex(self.des).pairs(self.neighbours)
 
     def matchFeatures(self):
+        for i, j in self.selectPairs():
+            if (i, j) in self.correlated:
+                self.addCorrelated(i, j)
+                continue
+            startPerf = time.perf_counter()
+            registered = self.matchPair(i, j)
+            elapsed = time.perf_counter() - startPerf
+            if registered:
+                result = self.matches[-1]
+                self.metrics.addPair(
+                    (i, j),
+                    time=elapsed,
+                    goodMatches=len(result),
+                    inliers=int(np.count_nonzero(result.inliers)),
+                    meanError=result.meanError,
+                    stdError=result.stdError,
+                    restricted=result.restricted,
+                    threshold=result.threshold,
+                    estimateTime=result.estimateTime,
+                )
+            else:
+                self.metrics.addPair((i, j), time=elapsed, registered=False)
+            # a sequence needs every link, an unordered set only a connected graph
+            if not registered and self.ordered:
+                self.fail = True
+                return
+
+    def correlate(self):
+        # consecutive captures of a sweep that mostly shift are placed by a few FFTs
+        # per pair, a weak correlation peak leaves the pair to feature matching
+        self.correlated = {}
+        if self.align != 'phase' or not self.ordered:
+            return
         for i in range(len(self.images) - 1):
-            flann = cv2.FlannBasedMatcher()
-            matches = flann.knnMatch(self.des[i], self.des[i + 1], k=2)
-            good_matches = []
-            for m, n in matches:
-                if m.distance < 0.75 * n.distance:
-                    good_matches.append(m)
-
-            pts1 = np.float32([self.kps[i][m.queryIdx].pt for m in good_matches]).reshape(-1, 1, 2)  # type: ignore
-            pts2 = np.float32([self.kps[i + 1][m.trainIdx].pt for m in good_matches]).reshape(-1, 1, 2)  # type: ignore
-            H, mask = cv2.findHomography(pts1, pts2, cv2.RANSAC, float(self.infos[2]))
-            matchesMask = mask.ravel().tolist()
-            dst = cv2.perspectiveTransform(pts1, H)
-            backproj_err = np.sqrt(np.sum((dst - pts2) ** 2, axis=2)).ravel()
-            mean_err = np.mean(backproj_err)
-            std_err = np.std(backproj_err)
-            # self.stdErrs.append(std_err)
-            inliers = [
-                matches[i] for i in range(len(matchesMask)) if matchesMask[i] == 1
-            ]
-            # self.inlierCounts.append(len(inliers))
-            outliers = [
-                matches[i] for i in range(len(matchesMask)) if matchesMask[i] == 0
-            ]
-            # self.outlierCounts.append(len(outliers))
-            draw_params = dict(
-                matchColor=(0, 255, 0),
-                singlePointColor=(0, 0, 255),
-                matchesMask=matchesMask,
-                flags=cv2.DrawMatchesFlags_NOT_DRAW_SINGLE_POINTS,
-            )
-            image = cv2.drawMatches(
-                self.images[i],
-                self.kps[i],
-                self.images[i + 1],
-                self.kps[i + 1],
-                good_matches,
-                None,
-                **draw_params,
-            )
-            image = cv2.putText(
-                image,
-                'method: ' + self.infos[0] + ' threshold: ' + str(self.infos[2]),
-                (10, 60),
-                cv2.FONT_HERSHEY_DUPLEX,
-                2,
-                (0, 0, 255),
-                3,
-            )
-            image = cv2.putText(
-                image,
-                'inliers: ' + str(len(inliers)) + 'outliers: ' + str(len(outliers)),
-                (10, 120),
-                cv2.FONT_HERSHEY_DUPLEX,
-                2,
-                (0, 0, 255),
-                3,
+            a, b = self.images[i], self.images[i + 1]
+            startPerf = time.perf_counter()
+            H, response = phaseAlign(a, b, self.phaseRotation)
+            if response < PHASE_MIN_RESPONSE:
+                continue
+            if self.refine == 'ecc':
+                H = refineHomography(a, b, H)
+            src, dst = correspondences(H, a.shape, b.shape)
+            if len(src) < MIN_PAIR_INLIERS:
+                continue
+            self.correlated[i, i + 1] = (
+                H,
+                (src, dst),
+                float(response),
+                time.perf_counter() - startPerf,
             )
-            image = cv2.putText(
-                image,
-                'accuracy: '
-                + str('{:.2%}'.format(len(inliers) / (len(inliers) + len(outliers)))),
-                (10, 180),
-                cv2.FONT_HERSHEY_DUPLEX,
-                2,
-                (0, 0, 255),
-                3,
+
+    def addCorrelated(self, i, j):
+        H, points, response, elapsed = self.correlated[i, j]
+        result = MatchResult(np.zeros((0, 2), np.int32), np.zeros((0, 2), np.float32))
+        result.correspondences = points
+        result.inliers = np.ones(len(points[0]), bool)
+        self.pairs.append((i, j))
+        self.Hs.append(H)
+        self.masks.append(result.inliers.astype(np.uint8).reshape(-1, 1))
+        self.matches.append(result)
+        self.metrics.addPair(
+            (i, j),
+            time=elapsed,
+            method='phase',
+            response=response,
+            inliers=len(result.inliers),
+        )
+
+    def predictOverlap(self, i, j):
+        # consecutive captures of a sweep move alike, so the last link predicts the
+        # next one and the hint covers the first
+        if not self.overlap or not self.ordered or j != i + 1:
+            return None
+        for (a, b), H in zip(reversed(self.pairs), reversed(self.Hs)):
+            if b == a + 1:
+                return H
+        return self.overlapHint
+
+    def matchPair(self, i, j):
+        H = self.predictOverlap(i, j)
+        if H is not None and self.des[i] is not None and self.des[j] is not None:
+            queryIdx = np.flatnonzero(
+                insideOverlap(self.kps[i][:, :2], H, self.images[j].shape)
             )
-            image = cv2.putText(
-                image,
-                'avgError: ' + str(mean_err) + ' stdError: ' + str(std_err),
-                (10, 240),
-                cv2.FONT_HERSHEY_DUPLEX,
-                2,
-                (0, 0, 255),
-                3,
+            trainIdx = np.flatnonzero(
+                insideOverlap(self.kps[j][:, :2], np.linalg.inv(H), self.images[i].shape)
             )
-            self.results.append(image)
-            self.Hs.append(H)
-            self.masks.append(mask)
+            enough = min(len(queryIdx), len(trainIdx)) >= MIN_PAIR_INLIERS
+            if enough and self.estimatePair(i, j, queryIdx, trainIdx):
+                return True
+        # a poor prediction falls back to matching everything, detection included
+        self.completeFeatures(i)
+        self.completeFeatures(j)
+        if self.des[i] is None or self.des[j] is None:
+            return False
+        return self.estimatePair(i, j)
 
-    def filter(self, image, show=False):
-        ksize = 15
-        sigma = 3
-        theta_range = np.arange(0, np.pi, 16)
-        imageProcessed = image
-
-        gabor_filters = []
-        for theta in theta_range:
-            kernel = cv2.getGaborKernel(
-                (ksize, ksize), sigma, theta, 10, 1, ktype=cv2.CV_32F
+    def estimatePair(self, i, j, queryIdx=None, trainIdx=None):
+        restricted = queryIdx is not None
+        queryDes, trainDes = self.des[i], self.des[j]
+        if restricted:
+            queryDes, trainDes = queryDes[queryIdx], trainDes[trainIdx]
+        result = MatchResult(
+            *knnMatch(self.infos[0].lower(), queryDes, trainDes, self.matcher)
+        )
+        if len(result) < 4:
+            return False
+        if restricted:
+            result.queryIdx = queryIdx[result.queryIdx].astype(np.int32)
+            result.trainIdx = trainIdx[result.trainIdx].astype(np.int32)
+            result.restricted = True
+
+        estimator = self.infos[1].lower()
+        if estimator == 'prosac':
+            # PROSAC draws its samples from the most distinctive matches first
+            result.reorder(np.argsort(result.ratios, kind='stable'))
+        pts1, pts2 = result.points(self.kps[i], self.kps[j])
+        result.threshold = float(self.infos[2])
+        startPerf = time.perf_counter()
+        H, mask = estimateHomography(
+            pts1, pts2, estimator, result.threshold, self.confidence, self.maxIters
+        )
+        if H is None:
+            return False
+        if self.adaptive:
+            H, mask, result.threshold = adaptInliers(pts1, pts2, H, mask, result.threshold)
+        result.estimateTime = time.perf_counter() - startPerf
+        if self.pyramidLevels and self.refine == 'ecc':
+            refined = refineHomography(self.images[i], self.images[j], H)
+            if refined is not H:
+                # coarse keypoints would pull the adjustment back off the refined H,
+                # it gets a grid through the refined H instead, as phase links do
+                H = refined
+                result.correspondences = correspondences(
+                    H, self.images[i].shape, self.images[j].shape
+                )
+        result.inliers = mask.ravel().astype(bool)
+        dst = cv2.perspectiveTransform(pts1, H)
+        backproj_err = np.linalg.norm(dst - pts2, axis=2).ravel()
+        mean_err = np.mean(backproj_err)
+        std_err = np.std(backproj_err)
+        inlierCount = int(np.count_nonzero(result.inliers))
+        if (restricted or not self.ordered) and inlierCount < MIN_PAIR_INLIERS:
+            return False
+        result.meanError, result.stdError = float(mean_err), float(std_err)
+        self.pairs.append((i, j))
+        self.Hs.append(H)
+        self.masks.append(mask)
+        self.matches.append(result)
+        if self.diagnostics:
+            self.addResult(
+                '特征点匹配 图%d+图%d' % (i + 1, j + 1),
+                sized(
+                    partial(self.renderMatches, len(self.pairs) - 1),
+                    self.images[i].shape[1] + self.images[j].shape[1],
+                    max(self.images[i].shape[0], self.images[j].shape[0]),
+                ),
             )
-            gabor_filters.append(kernel)
+        return True
+
+    def renderMatches(self, k, scale=1.0):
+        (i, j), result = self.pairs[k], self.matches[k]
+        images = [self.images[i], self.images[j]]
+        keypoints = [self.kps[i], self.kps[j]]
+        if scale != 1.0:
+            images = [
+                cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+                for image in images
+            ]
+            keypoints = [kps * np.float32([scale, scale, scale, 1]) for kps in keypoints]
+        draw_params = dict(
+            matchColor=(0, 255, 0),
+            singlePointColor=(0, 0, 255),
+            matchesMask=result.inliers.astype(np.uint8).tolist(),
+            flags=cv2.DrawMatchesFlags_NOT_DRAW_SINGLE_POINTS,
+        )
+        image = cv2.drawMatches(
+            images[0],
+            toKeyPoints(keypoints[0]),
+            images[1],
+            toKeyPoints(keypoints[1]),
+            result.toDMatches(),
+            None,
+            **draw_params,
+        )
+        inlierCount = int(np.count_nonzero(result.inliers))
+        outlierCount = len(result) - inlierCount
+        return putLines(
+            image,
+            [
+                'method: ' + self.infos[0] + ' threshold: ' + str(self.infos[2]),
+                'inliers: ' + str(inlierCount) + 'outliers: ' + str(outlierCount),
+                'accuracy: ' + str('{:.2%}'.format(inlierCount / len(result))),
+                'avgError: '
+                + str(result.meanError)
+                + ' stdError: '
+                + str(result.stdError),
+            ],
+            scale,
+        )
 
-        for kernel in gabor_filters:
-            imageProcessed = cv2.filter2D(image, cv2.CV_8UC3, kernel)
+    def filter(self, image, show=False):
+        imageProcessed = enhanceRidges(image, workers=self.workers)
         if show:
             matplotlib.rcParams['font.family'] = 'Microsoft YaHei'
             plt.figure(figsize=(10, 9))
 
             plt.subplot(1, 2, 1)
-            plt.imshow(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+            if image.ndim == 3:
+                plt.imshow(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+            else:
+                plt.imshow(image, cmap='gray')
             plt.title('Original Image/原图')
             plt.subplot(1, 2, 2)
-            plt.imshow(imageProcessed)
+            plt.imshow(imageProcessed, cmap='gray')
             plt.title('2D Gabor Filter/2D Gabor滤波器')
 
             plt.show()
         return imageProcessed
 
+    def enhance(self):
+        # detection runs on the enhanced ridges, the mosaic is still built from
+        # the captures themselves
+        if self.infos[4]:
+            self.enhanced = [self.filter(image) for image in self.images]
+            gaborSpectra.cache_clear()
+
+    def globalTransforms(self):
+        # grow a maximum spanning tree over the registered pairs, strongest links
+        # (most inliers) first, Hs[k] maps image pairs[k][0] onto image pairs[k][1]
+        weights = [int(np.count_nonzero(result.inliers)) for result in self.matches]
+        if self.ordered:
+            # start from the middle so drift spreads both ways along the sequence
+            reference = len(self.images) // 2
+        else:
+            strength = np.zeros(len(self.images))
+            for (a, b), weight in zip(self.pairs, weights):
+                strength[a] += weight
+                strength[b] += weight
+            reference = int(np.argmax(strength))
+        self.reference = reference
+        transforms = {reference: np.eye(3)}
+        while True:
+            edges = [
+                (weight, k)
+                for k, ((a, b), weight) in enumerate(zip(self.pairs, weights))
+                if (a in transforms) != (b in transforms)
+            ]
+            if not edges:
+                return transforms
+            k = max(edges)[1]
+            (a, b), H = self.pairs[k], self.Hs[k]
+            if a in transforms:
+                transforms[b] = transforms[a] @ np.linalg.inv(H)
+            else:
+                transforms[a] = transforms[b] @ H
+
+    def observations(self):
+        # every inlier, a subsample leaves whole regions of a pair unconstrained and
+        # lets the adjustment bend them
+        observations = []
+        for (a, b), result in zip(self.pairs, self.matches):
+            if result.correspondences is not None:
+                observations.append((a, b, *result.correspondences))
+                continue
+            inliers = np.flatnonzero(result.inliers)
+            observations.append(
+                (
+                    a,
+                    b,
+                    self.kps[a][result.queryIdx[inliers], :2].astype(np.float64),
+                    self.kps[b][result.trainIdx[inliers], :2].astype(np.float64),
+                )
+            )
+        return observations
+
     def stitch(self):
-        temp = []
-        for i in range(len(self.images) - 1):
-            H = self.Hs[i]
-            mask = self.masks[i]
-            height, width, channels = self.images[i + 1].shape
-            imageProcessed = cv2.warpPerspective(self.images[i + 1], H, (width, height))
-            imageProcessed = cv2.addWeighted(
-                imageProcessed, 0.5, self.images[i + 1], 0.5, 0
+        if self.fail:
+            return
+        transforms = self.globalTransforms()
+        if len(transforms) != len(self.images):
+            self.fail = True
+            return
+        adjust = self.adjust
+        if adjust is None:
+            # a connected graph has a cycle once it has as many links as images
+            adjust = len(self.pairs) >= len(self.images)
+        if adjust:
+            transforms = adjustHomographies(
+                transforms, self.observations(), self.reference
             )
-            temp.append(imageProcessed)
-            try:
-                temp[i] = (
-                    __import__('stitching')
-                    .Stitcher()
-                    .stitch([self.imagePaths[i], self.imagePaths[i + 1]])
+        transforms = [transforms[i] for i in range(len(self.images))]
+        self.transforms = transforms
+        if self.tileSize:
+            for a, b in self.pairs:
+                self.addResult(
+                    '拼接结果 图%d+图%d' % (a + 1, b + 1),
+                    renderMosaic(
+                        [self.images[a], self.images[b]],
+                        [transforms[a], transforms[b]],
+                        self.tileSize,
+                        workers=self.workers,
+                    ),
                 )
-                self.results.append(temp[i])
-            except:
-                self.fail = True
+            self.addResult(
+                '拼接结果 全部',
+                renderMosaic(
+                    self.images, transforms, self.tileSize, self.canvasPath, self.workers
+                ),
+            )
+            return
+        offset = self.canvasBounds(transforms)[0]
 
-        kp1, des1 = cv2.SIFT_create().detectAndCompute(temp[0], None)
-        kp2, des2 = cv2.SIFT_create().detectAndCompute(temp[1], None)
-        matches = cv2.FlannBasedMatcher().knnMatch(des1, des2, k=2)
-        good_matches = [m for m, n in matches if m.distance < 0.75 * n.distance]
+        # each image is warped once into its own footprint on the canvas, so memory
+        # grows with the inputs rather than with canvas size times image count
+        warped = [
+            self.warpImage(image, offset @ transform)
+            for image, transform in zip(self.images, transforms)
+        ]
+        for a, b in self.pairs:
+            self.addResult(
+                '拼接结果 图%d+图%d' % (a + 1, b + 1), self.blend([warped[a], warped[b]])
+            )
+        self.addResult('拼接结果 全部', self.blend(warped))
 
-        H, mask = cv2.findHomography(
-            np.float32([kp1[m.queryIdx].pt for m in good_matches]).reshape(-1, 1, 2),  # type: ignore
-            np.float32([kp2[m.trainIdx].pt for m in good_matches]).reshape(-1, 1, 2),  # type: ignore
-            cv2.RANSAC,
-            float(self.infos[2]),
-        )
-        warped = cv2.warpPerspective(
-            temp[1], H, (temp[0].shape[1] + temp[1].shape[1], temp[0].shape[0])
-        )
-        self.results.append(
-            __import__('stitching')
-            .Stitcher()
-            .stitch([self.imagePaths[0], self.imagePaths[1], self.imagePaths[2]])
+    def canvasBounds(self, transforms):
+        boxes = [bounds(image.shape, M) for image, M in zip(self.images, transforms)]
+        xMin, yMin = min(box[0] for box in boxes), min(box[1] for box in boxes)
+        xMax, yMax = max(box[2] for box in boxes), max(box[3] for box in boxes)
+        return translation(-xMin, -yMin), (xMax - xMin, yMax - yMin)
+
+    def warpImage(self, image, M):
+        x, y, right, bottom = bounds(image.shape, M)
+        M = translation(-x, -y) @ M
+        size = (right - x, bottom - y)
+        warped = cv2.warpPerspective(image, M, size)
+        mask = cv2.warpPerspective(
+            np.full(image.shape[:2], 255, np.uint8), M, size, flags=cv2.INTER_NEAREST
         )
+        return x, y, warped, mask
 
-    def _stitcher(self):
-        temp = []
-        for i in range(len(self.images) - 1):
-            H = self.Hs[i]
-            mask = self.masks[i]
-            # height, width, channels = self.images[i + 1].shape
-            imageProcessed = cv2.warpPerspective(
-                self.images[i],
-                H,
-                (
-                    self.images[i].shape[1] + self.images[i + 1].shape[1],
-                    self.images[i].shape[0],
-                ),
+    def blend(self, warped):
+        if self.blending != 'average':
+            return composite(warped, self.blending, self.seams)
+        left = min(x for x, _, _, _ in warped)
+        top = min(y for _, y, _, _ in warped)
+        right = max(x + image.shape[1] for x, _, image, _ in warped)
+        bottom = max(y + image.shape[0] for _, y, image, _ in warped)
+        total = np.zeros((bottom - top, right - left) + warped[0][2].shape[2:], np.float32)
+        count = np.zeros((bottom - top, right - left), np.float32)
+        for x, y, image, mask in warped:
+            x, y = x - left, y - top
+            height, width = mask.shape
+            weight = (mask > 0).astype(np.float32)
+            total[y : y + height, x : x + width] += image * (
+                weight[..., None] if image.ndim == 3 else weight
             )
-            # overlap = abs(self.images[i].shape[1] - imageProcessed.shape[1])
-            # alpha = np.linspace(0, 1, overlap)
-            # mask = np.concatenate(
-            #     [
-            #         np.zeros(self.images[i].shape[1] - overlap),
-            #         alpha,
-            #         np.ones(imageProcessed.shape[1]),
-            #     ]
-            # )
-            # result = self.images[i].shape[1] * mask + imageProcessed * (1 - mask)
-            imageProcessed[
-                0 : self.images[i + 1].shape[0], 0 : self.images[i + 1].shape[1]
-            ] = self.images[i + 1]
-            temp.append(imageProcessed)
-            self.results.append(imageProcessed)
-
-        # temp[1] = self.images[2]
-        kp1, des1 = cv2.SIFT_create().detectAndCompute(temp[0], None)
-        kp2, des2 = cv2.SIFT_create().detectAndCompute(temp[1], None)
-        matches = cv2.FlannBasedMatcher().knnMatch(des1, des2, k=2)
-        good_matches = [m for m, n in matches if m.distance < 0.75 * n.distance]
-
-        H, mask = cv2.findHomography(
-            np.float32([kp1[m.queryIdx].pt for m in good_matches]).reshape(-1, 1, 2),  # type: ignore
-            np.float32([kp2[m.trainIdx].pt for m in good_matches]).reshape(-1, 1, 2),  # type: ignore
-            cv2.RANSAC,
-            float(self.infos[2]),
-        )
-        warped = cv2.warpPerspective(
-            temp[0], H, (temp[0].shape[1] + temp[1].shape[1], temp[1].shape[0])
-        )
-        # output = cv2.addWeighted(temp[0], 0.5, temp[1], 0.5, 0)
-        # warped[0 : temp[1].shape[0], 0 : temp[1].shape[1]] = temp[1]
-
-        self.results.append(warped)
-        # self.results.append(output)
-
-    def smoothEdge(self):
-        for image in self.images:
-            image = image.astype(np.float32) / 255.0
-            smoothed = cv2.GaussianBlur(image, (0, 0), 2.0)
-            result = (smoothed * 255).astype(np.uint8)
-            self.results.append(smoothed)
-
-    def removeGhosting(self, mask, alpha=0.5):
-        image1 = self.images[0].astype(np.float32) / 255.0
-        image2 = self.images[1].astype(np.float32) / 255.0
-        mask = mask.astype(np.float32) / 255.0
-        result = cv2.addWeighted(image1, alpha, image2, 1 - alpha, 0)
-        result = result * (1 - mask) + image2 * mask
-        result = (result * 255).astype(np.uint8)
-        return result
+            count[y : y + height, x : x + width] += weight
+        count[count == 0] = 1
+        return (total / (count[..., None] if total.ndim == 3 else count)).astype(np.uint8)
 
     def readImages(self):
-        for path in self.imagePaths:
-            if os.path.exists(path):
-                self.images.append(cv2.imread(path))
+        # fingerprint captures carry no colour, grayscale keeps one channel throughout
+        workers = self.workers if self.workers > 1 else None
+        images, digests = loadImages(
+            self.imagePaths, self.grayscale, self.reduce, self.rawShape, workers
+        )
+        for image, digest in zip(images, digests):
+            self.images.append(conform(image, self.grayscale))
+            self.digests.append(digest)
+
+        # the coarse pyramid level is decoded reduced straight from the files instead
+        # of being pyramided down from the full resolution images
+        coarseReduce = self.reduce * 2**self.pyramidLevels
+        if self.pyramidLevels and coarseReduce <= 8:
+            self.coarse, _ = loadImages(
+                self.imagePaths, self.grayscale, coarseReduce, self.rawShape, workers
+            )
 
     def writeImages(self, path):
-        if os.path.exists(path):
-            shutil.rmtree(path)
-        os.mkdir(path)
+        # only overwrite our own files so concurrent runs can share a parent directory
+        os.makedirs(path, exist_ok=True)
         for i in range(len(self.results)):
-            cv2.imwrite(path + '/' + str(i) + '.jpg', self.results[i])
+            cv2.imwrite(os.path.join(path, str(i) + '.jpg'), self.result(i))
+
+    def addResult(self, title, image):
+        # diagnostics are added as render callables and only drawn when requested
+        self.sink(self.emitted, title, image)
+        self.emitted += 1
+
+    def result(self, index, scale=1.0):
+        image = self.results[index]
+        if callable(image):
+            return image(scale)
+        if scale != 1.0:
+            return cv2.resize(
+                image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA
+            )
+        return image
 
     def output(self):
-        return self.results, self.fail
+        return [self.result(i) for i in range(len(self.results))], self.fail
+
+    def stages(self):
+        return [
+            self.histogramEqualization,
+            self.enhance,
+            self.correlate,
+            self.findFeatures,
+            self.matchFeatures,
+            self.stitch,
+        ]
+
+    def cancel(self):
+        # honoured between stages, the stage already running finishes first
+        self.cancelled = True
+
+    def runStage(self, k, stage):
+        if self.cancelled:
+            return False
+        if self.progress is not None:
+            self.progress(stage.__name__, k, len(self.stages()))
+        with self.metrics.stage(stage.__name__):
+            stage()
+        return not self.cancelled
+
+    def stream(self):
+        # yields (index, title, image) as each stage finishes without keeping them
+        pending = []
+        self.sink = lambda index, title, image: pending.append((index, title, image))
+        for k, stage in enumerate(self.stages()):
+            if not self.runStage(k, stage):
+                return
+            while pending:
+                index, title, image = pending.pop(0)
+                yield index, title, image(1.0) if callable(image) else image
 
     def run(self):
-        self.histogramEqualization()
-        self.findFeatures()
-        self.matchFeatures()
-        self.stitch()
-        # self._stitcher()
-        if self.infos[6]:
-            self.writeImages('results')
+        for k, stage in enumerate(self.stages()):
+            if not self.runStage(k, stage):
+                return self.metrics
+        if self.infos[6] and isinstance(self.sink, MemorySink):
+            with self.metrics.stage('writeImages'):
+                self.writeImages(self.outputDir)
+        return self.metrics
 
 
 if __name__ == '__main__':
@@ -1,9 +1,10 @@
 import sys
 
 import cv2
-from PySide6.QtCore import (QCoreApplication, QDate, QDateTime, QFile, QLocale,
-                            QMetaObject, QObject, QPoint, QRect, QSize, Qt,
-                            QTime, QUrl)
+import numpy as np
+from PySide6.QtCore import (QCoreApplication, QDate, QDateTime, QEvent, QFile,
+                            QLocale, QMetaObject, QObject, QPoint, QRect,
+                            QSize, Qt, QThread, QTime, QUrl, Signal)
 from PySide6.QtGui import (QBrush, QColor, QConicalGradient, QCursor, QFont,
                            QFontDatabase, QGradient, QIcon, QImage,
                            QKeySequence, QLinearGradient, QPainter, QPalette,
@@ -11,76 +12,178 @@ from PySide6.QtGui import (QBrush, QColor, QConicalGradient, QCursor, QFont,
 from PySide6.QtUiTools import QUiLoader
 from PySide6.QtWidgets import (QApplication, QCheckBox, QComboBox, QDialog,
                                QFileDialog, QFrame, QGridLayout, QHBoxLayout,
-                               QLabel, QMainWindow, QPushButton, QSizePolicy,
-                               QSpinBox, QStatusBar, QVBoxLayout, QWidget)
+                               QLabel, QMainWindow, QPushButton, QScrollArea,
+                               QSizePolicy, QSpinBox, QStatusBar, QVBoxLayout,
+                               QWidget)
 from qt_material import apply_stylesheet
 
+from loading import ImageLoadError, loadImage, loadImages
+from sinks import DirectorySink
 from window_ui import Ui_MainWindow
 from works import Stitching
 
 
+# preview levels halve from the first one no larger than this down to the smallest
+PREVIEW_MAX_SIDE = 2048
+PREVIEW_MIN_SIDE = 128
+# diagnostics that do not tell their size are first drawn this small to learn it
+PROBE_SCALE = 1 / 16
+
+
+def toQImage(image):
+    # wraps a C contiguous array without converting it, the caller keeps the array
+    # alive for as long as the QImage is used
+    format = QImage.Format_Grayscale8 if image.ndim == 2 else QImage.Format_BGR888
+    return QImage(image.data, image.shape[1], image.shape[0], image.strides[0], format)
+
+
+def toPixmap(image):
+    image = np.ascontiguousarray(image)
+    return QPixmap.fromImage(toQImage(image))  # copies, image may go after this
+
+
+def fitScale(size, width, height):
+    return min(width / size[0], height / size[1], 1.0)
+
+
+def previewLevels(image):
+    levels = []
+    while max(image.shape[:2]) > PREVIEW_MAX_SIDE:
+        image = cv2.resize(image, None, fx=0.5, fy=0.5, interpolation=cv2.INTER_AREA)
+    levels.append(image)
+    while min(image.shape[:2]) >= 2 * PREVIEW_MIN_SIDE:
+        image = cv2.resize(image, None, fx=0.5, fy=0.5, interpolation=cv2.INTER_AREA)
+        levels.append(image)
+    return levels
+
+
+def loadThumbnails(paths, size):
+    # the coarsest reduced decode that still fills a label of size, the full
+    # resolution captures are decoded by the pipeline on the worker thread
+    images, _ = loadImages(paths, reduce=8)
+    for k, path in enumerate(paths):
+        for reduce in (4, 2, 1):
+            if images[k].shape[1] >= size[0] or images[k].shape[0] >= size[1]:
+                break
+            images[k], _ = loadImage(path, reduce=reduce)
+    return images
+
+
+class StitchWorker(QObject):
+    progress = Signal(str, int, int)
+    result = Signal(int, str, object)
+    finished = Signal(bool, bool, str)
+
+    def __init__(self, infos, imagePaths):
+        super(StitchWorker, self).__init__()
+        self.infos = infos
+        self.imagePaths = imagePaths
+        self.stitching = None
+        self.cancelled = False
+
+    def run(self):
+        directory = DirectorySink('results') if self.infos[6] else None
+
+        def sink(index, title, image):
+            if directory is not None:
+                directory(index, title, image)
+            self.result.emit(index, title, image)
+
+        try:
+            self.stitching = Stitching(
+                self.infos,
+                self.imagePaths,
+                sink=sink,
+                progress=self.progress.emit,
+            )
+            if self.cancelled:
+                self.stitching.cancel()
+            self.stitching.run()
+            self.finished.emit(self.stitching.fail, self.stitching.cancelled, '')
+        except Exception as e:
+            self.finished.emit(True, False, str(e))
+
+    def cancel(self):
+        # called from the UI thread, the pipeline stops before its next stage
+        self.cancelled = True
+        if self.stitching is not None:
+            self.stitching.cancel()
+
+
 class Main(QMainWindow, Ui_MainWindow):
     imagePaths = ['', '', '']
     infos = ['sift', 'ransac', '7.0', False, False, '图1+图2', False]
-    results = []
-    titleString = [
-        '特征点 图1',
-        '特征点 图2',
-        '特征点 图3',
-        '特征点匹配 图1+图2',
-        '特征点匹配 图1+图3',
-        '拼接结果 图1+图2',
-        '拼接结果 图2+图3',
-        '拼接结果 全部',
-    ]
+    results, outputs = [], []
+    previews, zoomed = {}, None
+    titleString = []
+    thread, worker = None, None
+    thumbnails = {}
+    stageNames = {
+        'histogramEqualization': '直方图均衡化',
+        'enhance': 'Gabor增强',
+        'correlate': '相位相关',
+        'findFeatures': '特征点提取',
+        'matchFeatures': '特征点匹配',
+        'stitch': '图像拼接',
+    }
 
     def __init__(self):
         super(Main, self).__init__()
         self.ui = Ui_MainWindow()
         self.ui.setupUi(self)
+        self.thumbnails = {}
+        self.previews = {}
+        self.ui.label.installEventFilter(self)
         self.ui.pushButton_L1.clicked.connect(lambda: self.readImage('L1'))
         self.ui.pushButton_L2.clicked.connect(lambda: self.readImage('L2'))
         self.ui.pushButton_L3.clicked.connect(lambda: self.readImage('L3'))
         self.ui.checkBox_13.stateChanged.connect(self.ifSaveImage)
         self.ui.comboBox_21.currentTextChanged.connect(self.setFeature)
         self.ui.doubleSpinBox_22.valueChanged.connect(self.setRansacThreshold)
+        self.ui.comboBox_23.currentTextChanged.connect(self.setEstimator)
         self.ui.horizontalSlider.valueChanged.connect(self.changeContent)
         self.ui.pushButton_25.clicked.connect(self.stitch)
+        self.ui.pushButton_cancel.clicked.connect(self.cancelStitch)
 
     def readImage(self, buttonLocation):
-        file_path, _ = QFileDialog.getOpenFileName(
-            self, "选择图片", "", 'Image files (*.png *.jpg)'
+        file_paths, _ = QFileDialog.getOpenFileNames(
+            self, "选择图片", "", 'Image files (*.png *.jpg *.bmp *.tif *.npy)'
         )
-        pixmap = QPixmap(file_path)
-        if file_path == '':
+        if not file_paths:
             return
-        if buttonLocation == 'L1':
-            self.ui.label_read1.setPixmap(
-                pixmap.scaled(
-                    self.ui.label_read1.size(),
-                    aspectMode=Qt.AspectRatioMode.KeepAspectRatio,
-                    mode=Qt.TransformationMode.SmoothTransformation,
-                )
-            )
-            self.imagePaths[0] = file_path
-        elif buttonLocation == 'L2':
-            self.ui.label_read2.setPixmap(
-                pixmap.scaled(
-                    self.ui.label_read2.size(),
-                    aspectMode=Qt.AspectRatioMode.KeepAspectRatio,
-                    mode=Qt.TransformationMode.SmoothTransformation,
-                )
-            )
-            self.imagePaths[1] = file_path
-        elif buttonLocation == 'L3':
-            self.ui.label_read3.setPixmap(
-                pixmap.scaled(
-                    self.ui.label_read3.size(),
+        labels = [self.ui.label_read1, self.ui.label_read2, self.ui.label_read3]
+        size = labels[0].size()
+        try:
+            images = loadThumbnails(file_paths, (size.width(), size.height()))
+        except ImageLoadError as e:
+            self.ui.statusbar.showMessage('无法读取图像: %s' % e)
+            return
+        self.thumbnails.update(zip(file_paths, images))
+        slot = int(buttonLocation[1:]) - 1
+        self.imagePaths += [''] * (slot + 1 - len(self.imagePaths))
+        if len(file_paths) == 1:
+            self.imagePaths[slot] = file_paths[0]
+        else:
+            # several captures picked at once replace the sequence from this slot on
+            self.imagePaths = self.imagePaths[:slot] + file_paths
+        self.thumbnails = {
+            path: image
+            for path, image in self.thumbnails.items()
+            if path in self.imagePaths
+        }
+        for label, path in zip(labels, self.imagePaths):
+            if path == '':
+                continue
+            label.setPixmap(
+                toPixmap(self.thumbnails[path]).scaled(
+                    label.size(),
                     aspectMode=Qt.AspectRatioMode.KeepAspectRatio,
                     mode=Qt.TransformationMode.SmoothTransformation,
                 )
             )
-            self.imagePaths[2] = file_path
+        self.ui.statusbar.showMessage(
+            '共%d张图像' % len([path for path in self.imagePaths if path != ''])
+        )
 
     def ifShowMessage(self, state):
         if state == Qt.CheckState.Checked.value:
@@ -115,48 +218,156 @@ class Main(QMainWindow, Ui_MainWindow):
     def setRansacThreshold(self, threshold):
         self.infos[2] = threshold
 
+    def setEstimator(self, estimator):
+        self.infos[1] = estimator.lower()
+
     def stitch(self):
+        if self.thread is not None:
+            return
         self._reset()
-        from PySide6.QtGui import QImage
-
-        s = Stitching(self.infos, self.imagePaths)
-        s.run()
-        output,fail = s.output()
         self.ui.label.clear()
-        if fail:
+        self.ui.horizontalSlider.setMaximum(0)
+
+        self.thread = QThread(self)
+        paths = [path for path in self.imagePaths if path != '']
+        self.worker = StitchWorker(list(self.infos), paths)
+        self.worker.moveToThread(self.thread)
+        self.thread.started.connect(self.worker.run)
+        self.worker.progress.connect(self.showProgress)
+        self.worker.result.connect(self.addResult)
+        self.worker.finished.connect(self.finishStitch)
+        self.thread.finished.connect(self.worker.deleteLater)
+        self.ui.pushButton_25.setEnabled(False)
+        self.ui.pushButton_cancel.setEnabled(True)
+        self.thread.start()
+
+    def cancelStitch(self):
+        if self.worker is not None:
+            self.worker.cancel()
+            self.ui.statusbar.showMessage('正在取消…')
+
+    def showProgress(self, stage, index, total):
+        self.ui.statusbar.showMessage(
+            '%s (%d/%d)' % (self.stageNames.get(stage, stage), index + 1, total)
+        )
+
+    def addResult(self, index, title, image):
+        # diagnostics arrive as render callables and are drawn when first shown
+        self.outputs.append(image)
+        self.results.append(None)
+        self.titleString.append(title)
+        self.ui.horizontalSlider.setMaximum(len(self.results) - 1)
+        if len(self.results) == 1:
+            self.changeContent(0)
+
+    def finishStitch(self, fail, cancelled, error):
+        if cancelled:
+            self.ui.statusbar.showMessage('已取消')
+        elif error:
+            self.ui.label_title.setText(error)
+            self.ui.statusbar.clearMessage()
+        elif fail:
             self.ui.label_title.setText('特征点匹配过少，拼接失败')
+            self.ui.statusbar.clearMessage()
         else:
-            for image in output:
-                image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-                qimg = QImage(
-                    image.data,
-                    image.shape[1],
-                    image.shape[0],
-                    image.shape[1] * 3,
-                    QImage.Format_RGB888,  # type: ignore
-                )
-                self.results.append(QPixmap(qimg))
-            self.ui.label.setPixmap(
-                self.results[0].scaled(
-                    self.ui.label.size(),
-                    aspectMode=Qt.AspectRatioMode.KeepAspectRatio,
+            self.ui.statusbar.showMessage('完成')
+        self.ui.pushButton_25.setEnabled(True)
+        self.ui.pushButton_cancel.setEnabled(False)
+        self.thread.quit()
+        self.thread.wait()
+        self.thread = None
+        self.worker = None
+
+    def image(self, index):
+        image = self.outputs[index]
+        return image(1.0) if callable(image) else image
+
+    def render(self, index, width, height):
+        # (full size, scale, preview levels) of an output. Diagnostics are drawn at
+        # the scale that fits the label rather than at full resolution
+        image = self.outputs[index]
+        if not callable(image):
+            return image.shape[1::-1], 1.0, previewLevels(image)
+        size = getattr(image, 'size', None)
+        if size is None:
+            probe = image(PROBE_SCALE)
+            size = (probe.shape[1] / PROBE_SCALE, probe.shape[0] / PROBE_SCALE)
+        scale = fitScale(size, width, height)
+        return size, scale, previewLevels(image(scale))
+
+    def pixmap(self, index):
+        # results hold the preview levels of each output, and previews the pixmaps
+        # fitted to the current label size
+        if index not in self.previews:
+            width, height = self.ui.label.width(), self.ui.label.height()
+            # a diagnostic drawn for a smaller label is drawn again
+            if (
+                self.results[index] is None
+                or fitScale(self.results[index][0], width, height)
+                > self.results[index][1] * 1.01
+            ):
+                self.results[index] = self.render(index, width, height)
+            levels = self.results[index][2]
+            # the smallest level that still covers the label, scaled down once
+            level = levels[0]
+            for candidate in levels:
+                if candidate.shape[1] >= width or candidate.shape[0] >= height:
+                    level = candidate
+            scale = min(width / level.shape[1], height / level.shape[0], 1.0)
+            if scale < 1.0:
+                level = cv2.resize(
+                    level, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA
                 )
-            )
-            self.ui.label_title.setText(self.titleString[0])
-            self.ui.horizontalSlider.setMaximum(len(self.results) - 1)
+            self.previews[index] = toPixmap(level)
+        return self.previews[index]
 
     def changeContent(self, value):
-        self.ui.label.setPixmap(
-            self.results[value].scaled(
-                self.ui.label.size(),
-                aspectMode=Qt.AspectRatioMode.KeepAspectRatio,
-                mode=Qt.TransformationMode.SmoothTransformation,
-            )
-        )
+        if not self.results:
+            return
+        self.ui.label.setPixmap(self.pixmap(value))
         self.ui.label_title.setText(self.titleString[value])
 
+    def closeEvent(self, event):
+        # a running pipeline stops after its current stage, the thread has to be
+        # finished before Qt destroys it
+        if self.thread is not None:
+            self.worker.finished.disconnect(self.finishStitch)
+            self.worker.cancel()
+            self.thread.quit()
+            self.thread.wait()
+            self.thread = None
+            self.worker = None
+        super(Main, self).closeEvent(event)
+
+    def resizeEvent(self, event):
+        super(Main, self).resizeEvent(event)
+        self.previews = {}
+        self.changeContent(self.ui.horizontalSlider.value())
+
+    def eventFilter(self, watched, event):
+        if watched is self.ui.label and event.type() == QEvent.MouseButtonDblClick:
+            self.zoom(self.ui.horizontalSlider.value())
+            return True
+        return super(Main, self).eventFilter(watched, event)
+
+    def zoom(self, index):
+        # only here is a result shown at full resolution
+        if not self.results:
+            return
+        image = self.image(index)
+        label = QLabel()
+        label.setPixmap(toPixmap(image))
+        self.zoomed = QScrollArea()
+        self.zoomed.setWidget(label)
+        self.zoomed.setWindowTitle(self.titleString[index])
+        self.zoomed.resize(min(image.shape[1] + 20, 1600), min(image.shape[0] + 20, 1000))
+        self.zoomed.show()
+
     def _reset(self):
+        self.outputs = []
         self.results = []
+        self.previews = {}
+        self.titleString = []
         self.ui.label_title.setText('')
 
 